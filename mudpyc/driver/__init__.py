@@ -8,8 +8,6 @@ from typing import NewType, Optional, Dict, Set, Tuple, Final, Union, List
 import logging
 logger = logging.getLogger(__name__)
 
-from mudpyc.util import AD
-
 LocalDir = NewType("LocalDir", str)
 ShortDir = NewType("ShortDir", str)
 IntlDir = NewType("IntlDir", str)
@@ -58,6 +56,31 @@ class ExitMatcher:
                 return self
         return None
 
+    @classmethod
+    def register_triggers(cls, engine, prio=0):
+        """
+        Add the patterns for the first line of an exit description to a
+        `TriggerEngine`. Lines are classified as "exits" or "no_exits".
+        """
+        for r in cls.M_INIT:
+            engine.add_regex(r, "exits", cls, prio=prio)
+        for r in cls.M_NONE:
+            engine.add_regex(r, "no_exits", cls, prio=prio)
+
+    @classmethod
+    def from_trigger(cls, trigger, match, msg):
+        """
+        Returns an ExitMatcher for a line classified by `register_triggers`.
+        """
+        self = cls()
+        if trigger.name == "exits":
+            self.line = match.group(1)
+            if cls.M_END.search(msg):
+                self.finish()
+        else:
+            self.finish()
+        return self
+
     def finish(self) -> None:
         if self.last:
             raise RuntimeError("Finished twice")
@@ -136,10 +159,27 @@ class Driver:
     _loc2intl: Dict[LocalDir,IntlDir] = None
     _intl2loc: Dict[IntlDir,LocalDir] = None
     _short2loc: Dict[ShortDir,LocalDir] = None
+    _loc2short: Dict[LocalDir,ShortDir] = None
     # cache
     _std_dirs: Set[Union[LocalDir,ShortDir]] = None
     _intl_dirs: Set[IntlDir] = None
 
+    # Speedwalking, i.e. several moves in one command.
+    # `speedwalk_repeat` formats `n` moves in (short) direction `d`, e.g.
+    # "{n}{d}" for "3n". `speedwalk_sep` joins moves, e.g. ";" or " ".
+    # `speedwalk_max` is the maximum length of a combined command.
+    # If repeat and separator are both None, each move is sent by itself.
+    # The MUD is expected to send one prompt per command.
+    speedwalk_repeat: Optional[str] = None
+    speedwalk_sep: Optional[str] = None
+    speedwalk_max: int = 70
+    # Number of steps a walk may combine (unless "walk_pipeline" is larger)
+    speedwalk_steps: int = 10
+
+    @property
+    def can_speedwalk(self) -> bool:
+        return self.speedwalk_repeat is not None or self.speedwalk_sep is not None
+
     keymap = {
         0: {
             21:"southwest",
@@ -159,7 +199,8 @@ class Driver:
     
     # WARNING you need to write your Lua setup code in such a way that it
     # can easily be re-executed without clearing or changing the current
-    # state.
+    # state. Mudlet only re-runs chunks that have changed (or after it has
+    # been restarted), but that still happens.
     lua_setup = ["""\
 function initGUI()
     print("Note: you don't have any MUD specific Mudlet code")
@@ -222,6 +263,62 @@ end
         """
         return self._short2loc.get(d,d)
 
+    def loc2short(self, d: LocalDir) -> str:
+        """
+        Translate a direction to its short form, e.g. "north" ⟶ "n".
+
+        Any unknown direction is returned unmodified.
+        """
+        return self._loc2short.get(d,d)
+
+    def speedwalk(self, moves: List[str]) -> List[Tuple[str,int]]:
+        """
+        Combine a sequence of moves into as few commands as the MUD
+        accepts. Only standard directions are combined; anything else is
+        sent as-is.
+
+        Returns a list of (command, number of moves) tuples.
+        """
+        rep,sep = self.speedwalk_repeat,self.speedwalk_sep
+        if rep is None and sep is None:
+            return [(m,1) for m in moves]
+
+        runs = []
+        for m in moves:
+            if runs and runs[-1][0] == m and self.is_std_dir(m):
+                runs[-1][1] += 1
+            else:
+                runs.append([m,1])
+
+        res = []
+        cur = None  # [parts, n_moves]
+        for m,n in runs:
+            if not self.is_std_dir(m):
+                if cur is not None:
+                    res.append(cur)
+                    cur = None
+                res.extend([[m],1] for _ in range(n))
+                continue
+            d = self.loc2short(m)
+            if rep is not None and n > 1:
+                parts = [(rep.format(n=n, d=d), n)]
+            else:
+                parts = [(d,1)]*n
+            for t,k in parts:
+                if cur is not None and sep is not None and \
+                        sum(len(x) for x in cur[0])+len(sep)*len(cur[0])+len(t) <= self.speedwalk_max:
+                    cur[0].append(t)
+                    cur[1] += k
+                else:
+                    if cur is not None:
+                        res.append(cur)
+                    cur = [[t],k]
+        if cur is not None:
+            res.append(cur)
+        # a single move is sent as-is
+        return [(self.short2loc(p[0]) if n == 1 else p[0] if len(p) == 1 else sep.join(p), n)
+                for p,n in res]
+
     def intl2loc(self, d: IntlDir) -> LocalDir:
         """
         Translate an international direction, as understood by Mudlet, to
@@ -323,9 +420,11 @@ end
         """
         Setup method to configure the standard directions.
 
-        This method builds _short2loc from _dir_local and _dir_short.
+        This method builds _short2loc and _loc2short from _dir_local and
+        _dir_short.
         """
         self._short2loc = { s:l for s,l in zip(self._dir_short,self._dir_local) }
+        self._loc2short = { l:s for s,l in zip(self._dir_short,self._dir_local) }
 
     def init_intl(self):
         """
@@ -371,8 +470,17 @@ end
         """
         return self.ExitMatcher.first_line(msg, colors)
 
+    def register_triggers(self, engine):
+        """
+        Add this MUD's line patterns to a `TriggerEngine`.
+
+        Override this (and call super()) to add more.
+        """
+        self.ExitMatcher.register_triggers(engine)
+
     def __init__(self, server):
-        self._server = weakref.ref(server)
+        # server is None when used offline, e.g. for importing a map
+        self._server = weakref.ref(server) if server is not None else lambda: None
         self.init_std_dirs()
         self.init_short2loc()
         self.init_intl()
@@ -386,9 +494,18 @@ end
         # extract "standard" GMCP data
         raise RuntimeError("TODO")
 
+    def gmcp_watchers(self):
+        """
+        Iterates (path, callback) pairs to watch parts of the GMCP tree.
+
+        The callbacks are awaited with the subtree's current value and the
+        parts that changed; see `mudpyc.gmcp.GMCPMirror.watch`.
+        """
+        return ()
+
     async def event_gmcp_comm_channel(self, msg):
         s = self.server
-        msg = AD(msg[2])  
+        msg = s.gmcp.get(msg[0])
         logger.debug("CHAN %r",msg)
         chan = msg.chan
         player = msg.player
@@ -1,8 +1,7 @@
 import trio
 
 from . import Driver as _Driver
-from mudpyc.util import AD
-from mudpyc.mapper.sql import NoData
+from mudpyc.mapper.const import NoData
 
 import logging
 logger = logging.getLogger(__name__)
@@ -84,6 +83,7 @@ end
     ]
 
     blink_hp: trio.CancelScope = None
+    blink_time = 0.5
 
     async def show_player(self):   
         s = self.server
@@ -91,36 +91,37 @@ end
         except AttributeError: name = "?"
         try: level = s.me.info.level
         except AttributeError: level = "?"
-        await s.mmud.GUI.spieler.echo(f"{name} [{level}]")
+        s.gui.set("GUI.spieler", "echo", f"{name} [{level}]")
 
-    async def _gui_vitals_color(self, lp_ratio=None, **kw):
+    def _gui_vitals_color(self, lp_ratio=None):
         s = self.server
         if lp_ratio is None:
             try:
-                lp_ratio = s.me.vitals.hp/self.me.maxvitals.max_hp
+                lp_ratio = s.me.vitals.hp/s.me.maxvitals.max_hp
             except AttributeError:
                 lp_ratio = 0.9
         if lp_ratio > 1:
             lp_ratio = 1
-        await s.mmud.GUI.lp_anzeige.setColor(255 * (1 - lp_ratio), 255 * lp_ratio, 50, **kw)
+        s.gui.set("GUI.lp_anzeige", "setColor", 255 * (1 - lp_ratio), 255 * lp_ratio, 50)
 
     async def _gui_vitals_blink_hp(self, task_status=trio.TASK_STATUS_IGNORED):
+        # Further hits while this runs only push the deadline back
         s = self.server
-        with trio.CancelScope() as cs:
+        with trio.CancelScope(deadline=trio.current_time()+self.blink_time) as cs:
             self.blink_hp = cs
             task_status.started(cs)
+            s.gui.set("GUI.lp_anzeige", "setColor", 255, 0, 50)
             try:
-                await s.mmud.GUI.lp_anzeige.setColor(255, 0, 50)
-                await trio.sleep(0.5)
-                await self._gui_vitals_color()
+                await trio.sleep_forever()
             finally:
                 if self.blink_hp == cs:
                     self.blink_hp = None
+        self._gui_vitals_color()
 
     async def show_room_label(self, room):
         s = self.server
         label = room.label or "-"
-        await s.mmud.GUI.raumtype.echo(label, noreply=True)
+        s.gui.set("GUI.raumtype", "echo", label)
 
     async def show_room_data(self, room=None):
         s = self.server
@@ -131,15 +132,15 @@ end
         else:
             await s.print("WARNING: you are in an unmapped room.")
         r,g,b = 30,30,30  # adapt for parallel worlds or whatever
-        await s.mmud.GUI.ort_raum.echo(room.name)
+        s.gui.set("GUI.ort_raum", "echo", room.name)
         if room.area:
-            await s.mmud.GUI.ort_region.echo(f"{room.area.name} [{room.id_str}]")
+            s.gui.set("GUI.ort_region", "echo", f"{room.area.name} [{room.id_str}]")
         else:
-            await s.mmud.GUI.ort_region.echo(f"? [{room.id_str}]")
+            s.gui.set("GUI.ort_region", "echo", f"? [{room.id_str}]")
             r,g,b = 80,30,30
 
-        await s.mmud.GUI.ort_raum.setColor(r, g, b)
-        await s.mmud.GUI.ort_region.setColor(r, g, b)
+        s.gui.set("GUI.ort_raum", "setColor", r, g, b)
+        s.gui.set("GUI.ort_region", "setColor", r, g, b)
         await self.show_room_label(room)
         await self.show_room_note(room)
 
@@ -159,7 +160,7 @@ end
                 note = note[:lf]
         else:
             note = "-"
-        await s.mmud.GUI.raumnotizen.echo(note)
+        s.gui.set("GUI.raumnotizen", "echo", note)
 
     async def show_vitals(self):
         s = self.server
@@ -170,26 +171,29 @@ end
         try:
             w = s.me.maxvitals
         except AttributeError:
-            await s.mmud.GUI.lp_anzeige.setValue(1,1, f"<b> {v.hp}/?</b> ", noreply=True)
-            await s.mmud.GUI.kp_anzeige.setValue(1,1, f"<b> {v.sp}/?</b> ", noreply=True)
-            await s.mmud.GUI.gift.echo("", noreply=True)
+            s.gui.set("GUI.lp_anzeige", "setValue", 1,1, f"<b> {v.hp}/?</b> ")
+            s.gui.set("GUI.kp_anzeige", "setValue", 1,1, f"<b> {v.sp}/?</b> ")
+            s.gui.set("GUI.gift", "echo", "")
         else:
-            await s.mmud.GUI.lp_anzeige.setValue(v.hp,w.max_hp, f"<b> {v.hp}/{w.max_hp}</b> ", noreply=True)
-            await s.mmud.GUI.kp_anzeige.setValue(v.sp,w.max_sp, f"<b> {v.sp}/{w.max_sp}</b> ", noreply=True)
+            s.gui.set("GUI.lp_anzeige", "setValue", v.hp,w.max_hp, f"<b> {v.hp}/{w.max_hp}</b> ")
+            s.gui.set("GUI.kp_anzeige", "setValue", v.sp,w.max_sp, f"<b> {v.sp}/{w.max_sp}</b> ")
             if v.poison:
                 r,g,b = 255,255-160*v.poison/w.max_poison,0
                 line = f"G I F T  {v.poison}/{w.max_poison}"
             else:
                 r,g,b = 30,30,30
                 line = ""
-            await s.mmud.GUI.gift.echo(line, "white", noreply=True)
-            await s.mmud.GUI.gift.setColor(r, g, b, noreply=True)
+            s.gui.set("GUI.gift", "echo", line, "white")
+            s.gui.set("GUI.gift", "setColor", r, g, b)
 
             if not self.blink_hp:
-                await self._gui_vitals_color(v.hp / w.max_hp, noreply=True)
+                self._gui_vitals_color(v.hp / w.max_hp)
 
         if "last_hp" in s.me and s.me.last_hp > v.hp:
-            await s.main.start(self._gui_vitals_blink_hp)
+            if self.blink_hp is not None:
+                self.blink_hp.deadline = trio.current_time()+self.blink_time
+            else:
+                await s.main.start(self._gui_vitals_blink_hp)
         s.me.last_hp = v.hp
 
         # TODO flight
@@ -245,7 +249,7 @@ end
         if not val:
             return False
         for x in "base info vitals maxvitals attributes".split():
-            try: s.me[x] = AD(val['char'][x])
+            try: s.me[x] = val['char'][x]
             except KeyError: pass
         await self.show_player()
 
@@ -262,42 +266,25 @@ end
                 await s.went_to_room(room)
         return True
 
-    async def event_gmcp_MG_char_attributes(self, msg):
-        s = self.server
-        logger.debug("AttrMG %s: %r",msg[1],msg[2])
-        s.me.attributes = AD(msg[2])   
-        await self.show_player()
-
-    async def event_gmcp_MG_char_base(self, msg):
-        s = self.server
-        logger.debug("BaseMG %s: %r",msg[1],msg[2])
-        s.me.base = AD(msg[2])
-        await self.show_player()
+    def gmcp_watchers(self):
+        yield "MG.char", self.gmcp_char
 
-    async def event_gmcp_MG_char_info(self, msg):
+    async def gmcp_char(self, char, changes):
         s = self.server
-        logger.debug("InfoMG %s: %r",msg[1],msg[2])
-        s.me.info = AD(msg[2])
-        await self.show_player()
-
-    async def event_gmcp_MG_char_vitals(self, msg):
-        s = self.server
-        logger.debug("VitalsMG %s: %r",msg[1],msg[2])
-        s.me.vitals = AD(msg[2])
-        await self.show_vitals()
-
-    async def event_gmcp_MG_char_maxvitals(self, msg):
-        s = self.server
-        logger.debug("MaxVitalsMG %s: %r",msg[1],msg[2])
-        s.me.maxvitals = AD(msg[2])
-        await self.show_vitals()
-
-    async def event_gmcp_MG_room_info(self, msg):   
+        logger.debug("CharMG: %r",changes)
+        if not isinstance(changes, dict):
+            return
+        for x in "base info vitals maxvitals attributes".split():
+            if x in changes:
+                s.me[x] = char.get(x)
+        if changes.keys() & {"base","info","attributes"}:
+            await self.show_player()
+        if changes.keys() & {"vitals","maxvitals"}:
+            await self.show_vitals()
+
+    async def event_gmcp_MG_room_info(self, msg):
         s = self.server
-        if len(msg) > 2:
-            info = AD(msg[2])
-        else:
-            info = await s.mud.gmcp.MG.room.info
+        info = s.gmcp.get("MG.room.info")
 
         c = s.current_command(no_info=True)
         await c.set_info(info)
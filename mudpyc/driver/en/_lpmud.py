@@ -1,6 +1,5 @@
 from . import Driver as _Driver
-from mudpyc.util import AD
-from mudpyc.mapper.sql import NoData
+from mudpyc.mapper.const import NoData
 
 import logging
 logger = logging.getLogger(__name__)
@@ -29,7 +28,7 @@ class Driver(_Driver):
         val = gmcp.get("Char", None)
         if val:
             for x in "base info vitals maxvitals attributes".split():
-                try: s.me[x] = AD(val['Char'][x])
+                try: s.me[x] = val['Char'][x]
                 except KeyError: pass
             await s.gui_show_player()
 
@@ -46,42 +45,25 @@ class Driver(_Driver):
                 await s.went_to_room(room)
         return True
 
-    async def event_gmcp_MG_char_attributes(self, msg):
-        s = self.server
-        logger.debug("AttrMG %s: %r",msg[1],msg[2])
-        s.me.attributes = AD(msg[2])   
-        await s.gui_show_player()
-
-    async def event_gmcp_MG_char_base(self, msg):
-        s = self.server
-        logger.debug("BaseMG %s: %r",msg[1],msg[2])
-        s.me.base = AD(msg[2])
-        await s.gui_show_player()
-
-    async def event_gmcp_MG_char_info(self, msg):
-        s = self.server
-        logger.debug("InfoMG %s: %r",msg[1],msg[2])
-        s.me.info = AD(msg[2])
-        await s.gui_show_player()
+    def gmcp_watchers(self):
+        yield "MG.char", self.gmcp_char
 
-    async def event_gmcp_MG_char_vitals(self, msg):
+    async def gmcp_char(self, char, changes):
         s = self.server
-        logger.debug("VitalsMG %s: %r",msg[1],msg[2])
-        s.me.vitals = AD(msg[2])
-        await s.gui_show_vitals()
-
-    async def event_gmcp_MG_char_maxvitals(self, msg):
-        s = self.server
-        logger.debug("MaxVitalsMG %s: %r",msg[1],msg[2])
-        s.me.maxvitals = AD(msg[2])
-        await s.gui_show_vitals()
+        logger.debug("CharMG: %r",changes)
+        if not isinstance(changes, dict):
+            return
+        for x in "base info vitals maxvitals attributes".split():
+            if x in changes:
+                s.me[x] = char.get(x)
+        if changes.keys() & {"base","info","attributes"}:
+            await s.gui_show_player()
+        if changes.keys() & {"vitals","maxvitals"}:
+            await s.gui_show_vitals()
 
-    async def event_gmcp_MG_room_info(self, msg):   
+    async def event_gmcp_MG_room_info(self, msg):
         s = self.server
-        if len(msg) > 2:
-            info = AD(msg[2])
-        else:
-            info = await s.mud.gmcp.MG.room.info
+        info = s.gmcp.get("MG.room.info")
 
         c = s.current_command(no_info=True)
         await c.set_info(info)
@@ -0,0 +1,168 @@
+# GMCP mirror
+#
+# Mudlet keeps the GMCP data it received in its global "gmcp" table. We
+# fetch that once when we start up; afterwards we keep a local copy
+# current from the values which Mudlet sends along with its "gmcp.*"
+# events, so reading GMCP data never needs a round trip.
+#
+# Code that's interested in some part of the tree can watch it. Watchers
+# are told what changed, not just that something did.
+
+from mudpyc.util import attrdict
+
+
+class _NoChange:
+    def __repr__(self):
+        return "NoChange"
+
+    def __bool__(self):
+        return False
+
+NoChange = _NoChange()
+
+
+def _ad(val):
+    # `AD` only converts the top level
+    if isinstance(val, dict):
+        return attrdict((k,_ad(v)) for k,v in val.items())
+    if isinstance(val, list):
+        return [_ad(v) for v in val]
+    return val
+
+
+def _path(path):
+    if isinstance(path, str):
+        if path.startswith("gmcp."):
+            path = path[5:]
+        path = path.split(".") if path else ()
+    return tuple(path)
+
+
+def diff(old, new):
+    """
+    Returns the part of @new that differs from @old, or `NoChange`.
+
+    Dicts are compared recursively; keys which have been removed are
+    reported as `None`. Anything else is returned whole.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        res = attrdict()
+        for k,v in new.items():
+            if k not in old:
+                res[k] = v
+                continue
+            d = diff(old[k], v)
+            if d is not NoChange:
+                res[k] = d
+        for k in old.keys() - new.keys():
+            res[k] = None
+        return res or NoChange
+    if type(old) is type(new) and old == new:
+        return NoChange
+    return new
+
+
+class GMCPMirror:
+    """
+    A local copy of Mudlet's GMCP tree.
+
+    Paths are either dotted strings (an initial "gmcp." is ignored) or
+    tuples.
+    """
+    def __init__(self):
+        self.data = attrdict()
+        self._watchers = {}  # path > set of callbacks
+
+    def get(self, path, default=None):
+        """
+        The data at @path, or @default if there's none.
+        """
+        val = self.data
+        for k in _path(path):
+            if not isinstance(val, dict):
+                return default
+            try:
+                val = val[k]
+            except KeyError:
+                return default
+        return val
+
+    def watch(self, path, callback):
+        """
+        Call ``await callback(value, changes)`` whenever something at or
+        below @path changes. @value is the subtree's current content.
+        """
+        path = _path(path)
+        try:
+            self._watchers[path].add(callback)
+        except KeyError:
+            self._watchers[path] = {callback}
+
+    def unwatch(self, path, callback):
+        path = _path(path)
+        cbs = self._watchers.get(path)
+        if not cbs:
+            return
+        cbs.discard(callback)
+        if not cbs:
+            del self._watchers[path]
+
+    async def load(self, tree):
+        """
+        Replace the whole tree, typically with Mudlet's ``gmcp`` table.
+        """
+        return await self.update((), tree)
+
+    async def update(self, path, value):
+        """
+        Mudlet got new data for @path. Watchers are notified.
+
+        Returns what changed (relative to @path), or `NoChange`.
+        """
+        path = _path(path)
+        value = _ad(value)
+        if not path:
+            if not isinstance(value, dict):
+                raise ValueError("The GMCP root must be a dict", value)
+            old, self.data = self.data, value
+        else:
+            d = self.data
+            for k in path[:-1]:
+                nd = d.get(k)
+                if not isinstance(nd, dict):
+                    nd = d[k] = attrdict()
+                d = nd
+            old = d.get(path[-1], NoChange)
+            d[path[-1]] = value
+        changes = diff(old, value)
+        if changes is not NoChange:
+            await self._notify(path, changes)
+        return changes
+
+    async def _notify(self, path, changes):
+        for wp,cbs in list(self._watchers.items()):
+            n = min(len(wp), len(path))
+            if wp[:n] != path[:n]:
+                continue
+            ch = changes
+            if len(wp) <= len(path):
+                # the change is somewhere inside the watched subtree
+                for k in reversed(path[len(wp):]):
+                    ch = attrdict({k: ch})
+            else:
+                # the watched subtree is somewhere inside the change
+                for k in wp[len(path):]:
+                    if not isinstance(ch, dict):
+                        # replaced wholesale
+                        ch = self.get(wp)
+                        break
+                    try:
+                        ch = ch[k]
+                    except KeyError:
+                        ch = NoChange
+                        break
+                if ch is NoChange:
+                    continue
+            val = self.get(wp)
+            for cb in list(cbs):
+                await cb(val, ch)
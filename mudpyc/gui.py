@@ -0,0 +1,89 @@
+# GUI widget state
+#
+# Status displays (vitals, room name, …) are updated on nearly every
+# prompt, mostly with the same content. `WidgetCache` remembers what was
+# last sent to each Geyser widget, drops updates which wouldn't change
+# anything, and sends the rest as one batch per tick to Mudlet's
+# `py.gui_batch`.
+
+import trio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WidgetCache:
+    """
+    Coalesce updates to Geyser widgets.
+
+    @send is an async function which gets a list of ``[widget, method,
+    args]`` triples and applies them, typically by calling
+    ``py.gui_batch``. Widgets are named by their dotted Lua path, e.g.
+    "GUI.spieler".
+    """
+    delay = 0.01
+
+    def __init__(self, send):
+        self._send = send
+        self._sent = {}  # (widget,method) > args
+        self._pending = {}  # (widget,method) > args
+        self._evt = trio.Event()
+        self.stats = dict(calls=0, sent=0, batches=0)
+
+    def set(self, widget, method, *args):
+        """
+        Call ``widget:method(*args)`` soon, unless that's what we did
+        last time. Returns a flag whether anything will be sent.
+        """
+        key = (widget, method)
+        self.stats["calls"] += 1
+        if self._sent.get(key) == args:
+            # back to what's displayed
+            self._pending.pop(key, None)
+            return False
+        self._pending[key] = args
+        self._evt.set()
+        return True
+
+    def forget(self, widget=None):
+        """
+        Don't assume anything about @widget's state (default: all).
+        Use this when Lua code changed it behind our back, or when Mudlet
+        reconnected.
+        """
+        if widget is None:
+            self._sent.clear()
+            return
+        for k in [k for k in self._sent if k[0] == widget]:
+            del self._sent[k]
+
+    async def flush(self):
+        """
+        Send pending updates now.
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._sent.update(pending)
+        self.stats["sent"] += len(pending)
+        self.stats["batches"] += 1
+        try:
+            await self._send([[w, m, list(a)] for (w,m),a in pending.items()])
+        except BaseException:
+            # we don't know what arrived
+            for k in pending:
+                self._sent.pop(k, None)
+            raise
+
+    async def run(self):
+        """
+        Task to send updates.
+        """
+        while True:
+            await self._evt.wait()
+            self._evt = trio.Event()
+            await trio.sleep(self.delay)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("GUI update failed")
@@ -0,0 +1,196 @@
+# Session log writer
+#
+# Lines are queued on a bounded channel and written in batches by a
+# background task, in a worker thread, so a slow disk never stalls input
+# handling. The log can be rotated by size and/or age; rotated segments
+# are optionally compressed with gzip or (if installed) zstandard.
+
+import os
+import gzip
+import time
+import shutil
+
+import trio
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class LogFile:
+    """
+    A session log.
+
+    @path: the file to write to.
+    @size: rotate when the file is larger than this many bytes.
+    @interval: rotate when the file is older than this many seconds.
+    @compress: "gzip" or "zstd" for rotated segments, None to keep them.
+    @queue: number of lines to buffer; if the writer can't keep up,
+            excess lines are dropped (and counted).
+    @delay: time to wait for more lines before writing a batch.
+
+    Call `write` like `print`. Start `run` in a nursery.
+    """
+    def __init__(self, path, *, size=None, interval=None, compress=None, queue=10000, delay=0.1):
+        if compress not in (None, "gzip", "zstd"):
+            raise ValueError("compress", compress)
+        self.path = path
+        self.size = size
+        self.interval = interval
+        self.compress = compress
+        self.delay = delay
+        self.dropped = 0
+        self.written = 0  # bytes in the current file
+        self._failed = False  # the last write didn't work
+
+        self._w,self._r = trio.open_memory_channel(queue)
+        self._f = None
+        self._opened = None
+
+    @classmethod
+    def from_cfg(cls, cfg):
+        """
+        Build from the "logfile" config entry: either a file name, or a
+        dict with "path" and the other arguments as keys.
+        """
+        if isinstance(cfg, str):
+            return cls(cfg)
+        cfg = dict(cfg)
+        return cls(cfg.pop("path"), **cfg)
+
+    def write(self, *args):
+        """
+        Queue a line. Never blocks.
+        """
+        try:
+            self._w.send_nowait(" ".join(str(a) for a in args)+"\n")
+        except trio.WouldBlock:
+            self.dropped += 1
+        except trio.ClosedResourceError:
+            pass
+
+    async def aclose(self):
+        """
+        Stop accepting lines. The writer exits after writing the rest.
+        """
+        await self._w.aclose()
+
+    async def run(self, *, task_status=trio.TASK_STATUS_IGNORED):
+        try:
+            await trio.to_thread.run_sync(self._open)
+        except OSError as exc:
+            # keep going; `_write` tries again
+            logger.error("Opening %s: %r", self.path, exc)
+            self._failed = True
+        task_status.started()
+        buf = []
+        try:
+            async with self._r:
+                async for line in self._r:
+                    buf.append(line)
+                    if self.delay:
+                        await trio.sleep(self.delay)
+                    self._collect(buf)
+                    self.dropped += await trio.to_thread.run_sync(self._write, buf)
+                    buf = []
+        finally:
+            # write what's left, even when cancelled
+            self._collect(buf)
+            with trio.CancelScope(shield=True):
+                await trio.to_thread.run_sync(self._close, buf)
+
+    def _collect(self, buf):
+        while True:
+            try:
+                buf.append(self._r.receive_nowait())
+            except (trio.WouldBlock, trio.EndOfChannel, trio.ClosedResourceError):
+                break
+        # `dropped` is only touched in the Trio thread
+        if self.dropped:
+            buf.append("*** %d lines dropped ***\n" % (self.dropped,))
+            self.dropped = 0
+
+    # The rest runs in a worker thread.
+
+    def _open(self):
+        self._f = open(self.path, "ab")
+        self._opened = time.time()
+        self.written = self._f.tell()
+
+    def _drop_file(self):
+        f,self._f = self._f,None
+        if f is not None:
+            try:
+                f.close()
+            except OSError:
+                pass
+
+    def _write(self, buf):
+        """
+        Write these lines. Returns the number of lines that couldn't be
+        written: if the file can't be written to, the error is logged
+        and the file is reopened with the next batch.
+        """
+        data = "".join(buf).encode("utf-8", "replace")
+        try:
+            if self._f is None:
+                self._open()
+            self._f.write(data)
+            self._f.flush()
+        except OSError as exc:
+            if not self._failed:
+                logger.error("Writing %s: %r", self.path, exc)
+                self._failed = True
+            self._drop_file()
+            return len(buf)
+        if self._failed:
+            logger.info("Writing %s again", self.path)
+            self._failed = False
+        self.written += len(data)
+
+        if self.size and self.written >= self.size or \
+                self.interval and time.time()-self._opened >= self.interval:
+            try:
+                self._rotate()
+            except OSError as exc:
+                logger.error("Rotating %s: %r", self.path, exc)
+                self._drop_file()
+        return 0
+
+    def _close(self, buf):
+        if buf:
+            self._write(buf)
+        self._drop_file()
+
+    def _rotate(self):
+        self._f.close()
+        dest = "%s.%s" % (self.path, time.strftime("%Y%m%d-%H%M%S"))
+        n = 0
+        while os.path.exists(dest) or os.path.exists(dest+".gz") or os.path.exists(dest+".zst"):
+            n += 1
+            dest = "%s.%s-%d" % (self.path, time.strftime("%Y%m%d-%H%M%S"), n)
+        os.rename(self.path, dest)
+        self._open()
+        if self.compress:
+            try:
+                compress_file(dest, self.compress)
+            except Exception:
+                logger.exception("Compressing %s", dest)
+
+
+def compress_file(path, method="gzip"):
+    """
+    Compress @path, then delete it. Uses gzip if zstandard is not available.
+    """
+    if method == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            logger.warning("zstandard is not installed, using gzip")
+            method = "gzip"
+    if method == "zstd":
+        with open(path, "rb") as src, open(path+".zst", "wb") as dst:
+            zstandard.ZstdCompressor().copy_stream(src, dst)
+    else:
+        with open(path, "rb") as src, gzip.open(path+".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    os.unlink(path)
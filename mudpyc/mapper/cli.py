@@ -0,0 +1,59 @@
+# Command line handling for the mapper
+
+import asyncclick as click
+import yaml
+import logging
+from importlib import import_module
+
+from mudpyc import WebServer
+from mudpyc.util import attrdict, combine_dict
+
+from .main import S, DEFAULT_CFG
+from .sql import SQL
+from .mudlet_map import MudletMap, import_map
+
+logger = logging.getLogger(__name__)
+
+async def import_mudlet_map(cfg, fn):
+    """
+    Offline import of a Mudlet map file into the database.
+    """
+    dr = import_module(cfg['driver']).Driver(None)
+    conf = cfg['settings']
+    explode = None
+    if conf['mudlet_explode']:
+        explode = (conf['pos_x_delta'], conf['pos_y_delta'])
+
+    async def progress(n):
+        logger.info("%d rooms ...", n)
+
+    with SQL(cfg) as db, MudletMap(fn) as mm:
+        logger.info("Map version %d, %d areas", mm.version, len(mm.areas))
+        nr,nx = await import_map(db, mm, dr, explode=explode, progress=progress, batch=5000)
+    logger.info("Import done: %d new rooms, %d new exits", nr, nx)
+
+@click.command()
+@click.option("-c","--config", type=click.File("r"), help="Config file")
+@click.option("-d","--debug", is_flag=True, help="Debug output")
+@click.option("-m","--migrate", count=True, help="do SQL migration? use -mm for deleting anything, -mmm for dropping tables")
+@click.option("-i","--import-map", type=click.Path(exists=True, dir_okay=False), help="Import this Mudlet map file, then exit")
+async def main(config,debug,migrate,import_map):
+    if config is None:
+        config = open("mapper.cfg","r")
+    cfg = yaml.safe_load(config)
+    cfg = combine_dict(cfg, DEFAULT_CFG, cls=attrdict)
+
+    if 'logging' in cfg:
+        from logging.config import dictConfig
+        if debug:
+            cfg['logging'].setdefault('root',{})['level'] = 'DEBUG'
+        dictConfig(cfg['logging'])
+    else:
+        logging.basicConfig(level=logging.DEBUG if debug else getattr(logging,cfg.log['level'].upper()))
+
+    if import_map:
+        await import_mudlet_map(cfg, import_map)
+        return
+
+    s = WebServer(cfg, factory=S)
+    await s.run()
@@ -58,3 +58,12 @@ ENV_STD=102
 ENV_SPECIAL=103
 ENV_UNMAPPED=104
 
+class NoData(RuntimeError):
+    def __str__(self):
+        if self.args:
+            try:
+                return "‹NoData:{jsa}›".format(jsa=':'.join(str(x) for x in self.args))
+            except Exception:
+                pass
+        return "‹NoData›"
+    pass
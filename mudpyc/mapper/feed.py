@@ -0,0 +1,92 @@
+# Map change feed
+#
+# A `WebServer` can host several MudPyC servers, one per Mudlet profile,
+# each with its own database session and caches. When one of them changes
+# the map, it publishes what it changed (after the transaction has been
+# committed); the others follow the feed and update their sessions,
+# caches and Mudlet maps incrementally.
+#
+# The feed is shared by all servers in this process which use the same
+# database URL.
+
+from collections import deque
+
+import trio
+
+from mudpyc.util import attrdict
+
+
+class MapChanges(attrdict):
+    """
+    What a transaction changed.
+
+    rooms: id_old > "new" or "mod"
+    deleted: id_old > id_mudlet, for deleted rooms
+    exits: IDs of rooms whose exits changed
+    areas: IDs of changed areas
+    generation: the map's generation after the change
+    """
+    def __init__(self):
+        super().__init__(rooms={}, deleted={}, exits=set(), areas=set(), generation=None)
+
+    def __bool__(self):
+        return bool(self.rooms or self.deleted or self.exits or self.areas)
+
+
+class MapFeed:
+    """
+    A bounded log of `MapChanges`.
+
+    Subscribers which fall behind by more than @size entries get a `None`
+    and should reload everything.
+    """
+    _feeds = {}
+
+    @classmethod
+    def for_url(cls, url):
+        try:
+            return cls._feeds[url]
+        except KeyError:
+            res = cls._feeds[url] = cls()
+            return res
+
+    def __init__(self, size=1000):
+        self._log = deque(maxlen=size)  # (seq, source, changes)
+        self._seq = 0
+        self._evt = trio.Event()
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def publish(self, source, changes):
+        """
+        Add a change set. @source is whoever made the changes; it won't
+        see them in its own subscription.
+        """
+        self._seq += 1
+        self._log.append((self._seq, source, changes))
+        self._evt.set()
+        self._evt = trio.Event()
+
+    async def follow(self, source, seq=None):
+        """
+        Iterate the changes made by others, starting after @seq
+        (default: now).
+        """
+        if seq is None:
+            seq = self._seq
+        while True:
+            while seq == self._seq:
+                await self._evt.wait()
+            if self._log[0][0] > seq+1:
+                # we missed some
+                seq = self._seq
+                yield None
+                continue
+            for s,src,changes in list(self._log):
+                if s <= seq:
+                    continue
+                seq = s
+                if src is not source:
+                    yield changes
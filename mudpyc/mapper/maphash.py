@@ -0,0 +1,39 @@
+# Room content hashes
+#
+# To sync the database with Mudlet's map we compare a hash of each room's
+# content: position, area, environment, name and exits. The Mudlet side
+# is computed by `py.roomHashes` in mudpyc.xml; both must agree exactly.
+# tests/test_mudlet_xml.py checks them against the same fixed values.
+#
+# The hash is djb2 over the UTF-8 text
+#     "x,y,z|area|env|name|exits"
+# where "exits" is the sum (mod 2³²) of the hashes of "dir=dst" for each
+# exit with a destination, so that it doesn't depend on their order.
+# Unset areas and environments are -1, as in Mudlet.
+
+M32 = 1<<32
+
+
+def djb2(data):
+    """
+    The djb2 hash of a bytestring, mod 2³².
+    """
+    h = 5381
+    for c in data:
+        h = (h*33 + c) % M32
+    return h
+
+
+def room_hash(x, y, z, area, env, name, exits):
+    """
+    @exits is an iterable of (direction, Mudlet ID of the destination).
+    Directions must be the ones Mudlet uses, i.e. `Driver.loc2intl`.
+    """
+    ex = 0
+    for d,dst in exits:
+        ex += djb2(("%s=%d" % (d,dst)).encode("utf-8"))
+    s = "%d,%d,%d|%d|%d|%s|%d" % (x,y,z,
+            area if area is not None else -1,
+            env if env is not None else -1,
+            name or "", ex % M32)
+    return djb2(s.encode("utf-8"))
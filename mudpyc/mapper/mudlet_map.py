@@ -0,0 +1,554 @@
+# Reader for Mudlet's binary map files
+#
+# Mudlet saves its map as a Qt QDataStream ("…/profiles/NAME/map/*.dat").
+# This module parses that format directly so that we can seed or rebuild
+# our database from a map backup without a running Mudlet and without
+# one RPC per room and exit.
+#
+# Supported are map versions 17 to 20, which covers Mudlet 3.x and 4.x.
+# Map labels are skipped: our database has no place for them, and they
+# stay in Mudlet's map anyway.
+#
+# `MapImport` merges Mudlet rooms into our database (`import_map`).
+
+import os
+import mmap
+import struct
+from glob import glob
+
+import trio
+
+from mudpyc.util import attrdict
+from .const import NoData
+
+import logging
+logger = logging.getLogger(__name__)
+
+MIN_VERSION = 17
+MAX_VERSION = 20
+
+# Mudlet's standard exits, in the order they're stored in a room
+EXIT_DIRS = ("north","northeast","east","southeast","south","southwest",
+        "west","northwest","up","down","in","out")
+# Mudlet's direction codes (as used for exit stubs and locks), minus one
+STUB_DIRS = ("north","northeast","northwest","east","west","south",
+        "southeast","southwest","up","down","in","out")
+
+_i32 = struct.Struct(">i")
+_u32 = struct.Struct(">I")
+_f64 = struct.Struct(">d")
+_color = struct.Struct(">bHHHHH")
+
+_PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+
+class MapFormatError(ValueError):
+    """
+    The map file is damaged or uses a format we don't understand.
+    """
+    pass
+
+
+class _Stream:
+    """
+    A minimal QDataStream reader on top of a buffer.
+
+    All numbers are big-endian; floating point values are stored as
+    doubles (Qt's default since 4.6).
+    """
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+        self.end = len(buf)
+
+    @property
+    def at_end(self):
+        return self.pos >= self.end
+
+    def _unpack(self, st):
+        try:
+            res, = st.unpack_from(self.buf, self.pos)
+        except struct.error:
+            raise MapFormatError("truncated", self.pos) from None
+        self.pos += st.size
+        return res
+
+    def int(self):
+        return self._unpack(_i32)
+
+    def uint(self):
+        return self._unpack(_u32)
+
+    def double(self):
+        return self._unpack(_f64)
+
+    def byte(self):
+        if self.pos >= self.end:
+            raise MapFormatError("truncated", self.pos)
+        res = self.buf[self.pos]
+        self.pos += 1
+        return res
+
+    def bool(self):
+        if self.pos >= self.end:
+            raise MapFormatError("truncated", self.pos)
+        res = self.buf[self.pos] != 0
+        self.pos += 1
+        return res
+
+    def string(self):
+        n = self.uint()
+        if n == 0xFFFFFFFF:
+            return None
+        if n & 1:
+            raise MapFormatError("odd string length", self.pos)
+        res = self.buf[self.pos:self.pos+n]
+        if len(res) != n:
+            raise MapFormatError("truncated", self.pos)
+        self.pos += n
+        return bytes(res).decode("utf-16-be")
+
+    def color(self):
+        try:
+            spec,a,r,g,b,_pad = _color.unpack_from(self.buf, self.pos)
+        except struct.error:
+            raise MapFormatError("truncated", self.pos) from None
+        self.pos += _color.size
+        if spec == 0:  # invalid
+            return None
+        return (r>>8, g>>8, b>>8, a>>8)
+
+    def vector3d(self):
+        return (self.double(), self.double(), self.double())
+
+    def pointf(self):
+        return (self.double(), self.double())
+
+    def list(self, item):
+        return [item() for _ in range(self.uint())]
+
+    def map(self, key, value):
+        res = {}
+        for _ in range(self.uint()):
+            k = key()
+            res[k] = value()
+        return res
+
+    def multimap(self, key, value):
+        res = []
+        for _ in range(self.uint()):
+            k = key()
+            res.append((k, value()))
+        return res
+
+    def skip_pixmap(self):
+        """
+        Step over a QPixmap, i.e. a "not null" marker and a PNG image.
+        The PNG is not length-prefixed, so walk its chunks.
+        """
+        if not self.int():
+            return
+        if bytes(self.buf[self.pos:self.pos+8]) != _PNG_MAGIC:
+            raise MapFormatError("label image is not a PNG", self.pos)
+        self.pos += 8
+        while True:
+            n = self.uint()
+            typ = bytes(self.buf[self.pos:self.pos+4])
+            self.pos += 4+n+4  # type, data, CRC
+            if self.pos > self.end:
+                raise MapFormatError("truncated", self.pos)
+            if typ == b"IEND":
+                return
+
+
+class MudletMap:
+    """
+    Read a Mudlet map file.
+
+    The header (areas, hashes, user data) is parsed when the file
+    is opened; rooms are decoded on demand by iterating `rooms`, so a
+    large map never needs to be in memory all at once.
+
+    Use as a context manager::
+
+        with MudletMap(path) as mm:
+            for room in mm.rooms():
+                ...
+    """
+    version = None
+
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+        self._mm = None
+
+        self.env_colors = {}
+        self.area_names = {}
+        self.areas = {}
+        self.hashes = {}  # mudlet room ID > GMCP hash
+        self.user_data = {}
+        self.player_room = {}
+        self._rooms_at = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *tb):
+        self.close()
+
+    def open(self):
+        self._f = open(self.path, "rb")
+        try:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._read_header()
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def _read_header(self):
+        s = _Stream(self._mm)
+        self.version = v = s.int()
+        if not MIN_VERSION <= v <= MAX_VERSION:
+            raise MapFormatError(f"Map version {v} is not supported ({MIN_VERSION}…{MAX_VERSION})")
+
+        self.env_colors = s.map(s.int, s.int)
+        self.area_names = s.map(s.int, s.string)
+        s.map(s.int, s.color)  # custom env colors
+        self.hashes = {r:h for h,r in s.map(s.string, s.int).items()}
+        self.user_data = s.map(s.string, s.string)
+        if v >= 19:
+            s.string()  # symbol font
+            s.double()  # font fudge factor
+            s.bool()  # only use that font
+
+        for _ in range(s.int()):
+            aid = s.int()
+            a = attrdict(id=aid, name=self.area_names.get(aid, None))
+            a.rooms = s.list(s.int)
+            s.list(s.int)  # z levels
+            s.multimap(s.int, lambda: (s.int(), s.int()))  # area exits
+            a.grid = s.bool()
+            for _ in range(6):  # min/max x/y/z
+                s.int()
+            s.vector3d()  # span
+            for _ in range(4):  # min/max x/y for each z
+                s.map(s.int, s.int)
+            s.vector3d()  # pos
+            s.bool()  # zone
+            s.int()  # zone ref
+            a.user_data = s.map(s.string, s.string)
+            self.areas[aid] = a
+
+        if v >= 18:
+            self.player_room = s.map(s.string, s.int)
+        else:
+            self.player_room = {"": s.int()}
+
+        # Skip the labels. Per area: the label count comes before the
+        # area ID.
+        for _ in range(s.int()):
+            n = s.int()
+            s.int()  # area
+            for _ in range(n):
+                s.int()  # ID
+                s.vector3d()  # pos
+                s.pointf()  # unused
+                s.pointf()  # size
+                s.string()  # text
+                s.color()  # fg
+                s.color()  # bg
+                s.skip_pixmap()
+                s.bool()  # no scaling
+                s.bool()  # show on top
+
+        self._rooms_at = s.pos
+
+    def _read_room(self, s):
+        v = self.version
+        r = attrdict(id=s.int())
+        r.area = s.int()
+        r.x = s.int()
+        r.y = s.int()
+        r.z = s.int()
+        r.exits = {}
+        for d in EXIT_DIRS:
+            dst = s.int()
+            if dst > 0:
+                r.exits[d] = dst
+        r.env = s.int()
+        r.weight = s.int()
+        r.name = s.string() or ""
+        r.locked = s.bool()
+
+        # Special exits. The command is prefixed with a '0' or '1' lock flag.
+        r.special = {}
+        for dst,cmd in s.multimap(s.int, s.string):
+            if cmd and cmd[0] in "01":
+                cmd = cmd[1:]
+            if cmd and dst > 0:
+                r.special[cmd] = dst
+
+        if v >= 19:
+            r.symbol = s.string()
+        else:
+            s.byte()  # old single-char symbol
+            r.symbol = None
+        r.user_data = s.map(s.string, s.string)
+
+        s.map(s.string, lambda: s.list(s.pointf))  # custom lines
+        s.map(s.string, s.bool)  # … arrows
+        if v >= 20:
+            s.map(s.string, s.color)  # … colors
+            s.map(s.string, s.int)  # … styles
+        else:
+            s.map(s.string, lambda: s.list(s.int))
+            s.map(s.string, s.string)
+        s.list(s.int)  # exit locks
+        r.stubs = [STUB_DIRS[d-1] for d in s.list(s.int) if 0 < d <= len(STUB_DIRS)]
+        r.weights = s.map(s.string, s.int)
+        s.map(s.string, s.int)  # doors
+
+        r.hash = self.hashes.get(r.id, None)
+        return r
+
+    def rooms(self):
+        """
+        Iterate the rooms in this map.
+
+        Each room is an attrdict with id, area, x/y/z, name, env, weight,
+        hash, symbol, user_data, stubs, and two exit dicts: "exits" uses
+        Mudlet's standard direction names while "special" uses the
+        special exits' commands. Both map to Mudlet room IDs.
+        """
+        if self._mm is None:
+            raise RuntimeError("not open")
+        s = _Stream(self._mm)
+        s.pos = self._rooms_at
+        while not s.at_end:
+            yield self._read_room(s)
+
+
+def find_map_file(profile, base=None):
+    """
+    Return the most recent map file saved by this Mudlet profile, or None.
+    """
+    if base is None:
+        base = os.path.join(os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config")), "mudlet")
+    files = glob(os.path.join(base, "profiles", profile, "map", "*.dat"))
+    if not files:
+        return None
+    return max(files, key=os.path.getmtime)
+
+
+class MapImport:
+    """
+    Merge Mudlet rooms into our database.
+
+    Rooms we know (by Mudlet ID, or by GMCP hash if they're not in Mudlet
+    yet) keep their data. Exits which we don't know yet are added; known
+    exits only get a destination if they don't have one.
+
+    Rooms are looked up in the database as needed. Call `preload` first
+    if you're going to process most of them.
+
+    @explode is an optional (x,y) factor for spreading the rooms'
+    coordinates.
+    """
+    def __init__(self, db, dr, explode=None):
+        self.db = db
+        self.dr = dr
+        self.explode = explode
+        self.n_rooms = 0
+        self.n_exits = 0
+        self._by_mudlet = None
+        self._by_hash = None
+        self._areas = set()
+
+    def preload(self):
+        """
+        Read all rooms' IDs, instead of one query per lookup.
+        """
+        db = self.db
+        self._by_mudlet = {}
+        self._by_hash = {}
+        for r in db.q(db.Room).all():
+            if r.id_mudlet:
+                self._by_mudlet[r.id_mudlet] = r
+            elif r.id_gmcp:
+                self._by_hash[r.id_gmcp] = r
+
+    def area(self, aid, name=None):
+        """
+        Make sure that this area exists. Mudlet's default area (negative
+        ID) is skipped; returns None for it, the ID otherwise.
+        """
+        if aid is None or aid < 0:
+            return None
+        if aid not in self._areas:
+            db = self.db
+            if db.q(db.Area).filter(db.Area.id == aid).one_or_none() is None:
+                db.add(db.Area(id=aid, name=name or str(aid)))
+            self._areas.add(aid)
+        return aid
+
+    def find(self, mid, hash=None):
+        """
+        Return our room for Mudlet room @mid, or None.
+
+        A room that's found by @hash gets that Mudlet ID.
+        """
+        db = self.db
+        if self._by_mudlet is not None:
+            room = self._by_mudlet.get(mid)
+        else:
+            try:
+                room = db.r_mudlet(mid, "plain")
+            except NoData:
+                room = None
+        if room is not None or not hash:
+            return room
+
+        if self._by_hash is not None:
+            room = self._by_hash.pop(hash, None)
+        else:
+            try:
+                room = db.r_hash(hash, "plain")
+            except NoData:
+                room = None
+            else:
+                if room.id_mudlet:
+                    room = None  # a different Mudlet room
+        if room is not None:
+            room.set_id_mudlet(mid)
+            if self._by_mudlet is not None:
+                self._by_mudlet[mid] = room
+        return room
+
+    def room(self, mr):
+        """
+        Return our room for the Mudlet room @mr, creating it if necessary.
+
+        @mr is an attrdict with id, name, hash, area and x/y/z, as
+        returned by `MudletMap.rooms`. If the room is new, its position
+        is copied (and exploded). Returns a (room, is_new) tuple.
+        """
+        room = self.find(mr.id, mr.hash)
+        if room is not None:
+            return room, False
+
+        db = self.db
+        room = db.Room(name=self.dr.clean_shortname(mr.name) if mr.name else None,
+                id_mudlet=mr.id, id_gmcp=mr.hash or None)
+        x,y = mr.x,mr.y
+        if self.explode:
+            x *= self.explode[0]
+            y *= self.explode[1]
+        room.pos_x,room.pos_y,room.pos_z = x,y,mr.z
+        room.area_id = self.area(mr.area, mr.get("area_name"))
+        db.add(room)
+        if self._by_mudlet is not None:
+            self._by_mudlet[mr.id] = room
+        self.n_rooms += 1
+        return room, True
+
+    def exit(self, room, d, dst, known=None):
+        """
+        Teach @room that its exit @d (a local direction) leads to @dst,
+        which may be None for a stub. Returns the exit if it's new or has
+        changed, else None.
+
+        @known is a dir > exit dict of the room's exits, which is updated.
+        """
+        db = self.db
+        if known is None:
+            known = {x.dir:x for x in room.exits}
+        x = known.get(d)
+        if x is None:
+            known[d] = x = db.Exit(src=room, dir=d, dst=dst, flag=db.Exit.F_IN_MUDLET)
+            db.add(x)
+        elif dst is None or x.dst_id is not None:
+            return None
+        else:
+            x.dst = dst
+            x.flag = (x.flag or 0) | db.Exit.F_IN_MUDLET
+        db.update_cache(room)
+        self.n_exits += 1
+        return x
+
+    def exits(self, room, mr):
+        """
+        Add the exits of Mudlet room @mr (see `MudletMap.rooms`) to
+        @room. Destinations we don't know are skipped.
+        """
+        dr = self.dr
+        known = {x.dir:x for x in room.exits}
+        ex = [(dr.intl2loc(d),dst) for d,dst in mr.exits.items()]
+        ex.extend(mr.special.items())
+        for d,dst in ex:
+            dst = self.find(dst)
+            if dst is not None:
+                self.exit(room, d, dst, known)
+        for d in mr.stubs:
+            d = dr.intl2loc(d)
+            if d not in known:
+                self.exit(room, d, None, known)
+
+
+async def import_map(db, mm, dr, *, explode=None, progress=None, batch=500):
+    """
+    Copy the contents of a Mudlet map into our database, using `MapImport`.
+
+    @mm is an open `MudletMap`, @dr the driver (for translating
+    directions). @explode is an optional (x,y) factor for spreading
+    the rooms' coordinates. @progress is an async callback, called with
+    the number of rooms processed.
+
+    Returns a (new rooms, new exits) tuple.
+    """
+    imp = MapImport(db, dr, explode=explode)
+    for aid,a in mm.areas.items():
+        imp.area(aid, a.name)
+    db.commit()
+    imp.preload()
+
+    # Pass 1: rooms
+    n_done = 0
+    for mr in mm.rooms():
+        mr.area_name = mm.area_names.get(mr.area)
+        imp.room(mr)
+
+        n_done += 1
+        if not n_done % batch:
+            db.commit()
+            if progress is not None:
+                await progress(n_done)
+            await trio.sleep(0)
+    db.commit()
+
+    # Pass 2: exits. Load each batch of rooms with their exits.
+    async def do_exits(todo):
+        rooms = {r.id_mudlet:r for r in db.rooms([imp.find(mr.id) for mr in todo], "exits")}
+        for mr in todo:
+            imp.exits(rooms[mr.id], mr)
+        db.commit()
+        await trio.sleep(0)
+
+    todo = []
+    for mr in mm.rooms():
+        todo.append(mr)
+        if len(todo) >= batch:
+            await do_exits(todo)
+            todo = []
+    if todo:
+        await do_exits(todo)
+
+    return imp.n_rooms, imp.n_exits
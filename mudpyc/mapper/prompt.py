@@ -0,0 +1,205 @@
+# Prompt timing
+#
+# A command is finished when the MUD sends both its text prompt and a
+# telnet GA. If only one of them shows up, we wait a while for the other.
+# Instead of a fixed delay, these timeouts are derived from what this MUD
+# actually does: how long after the first signal the second one arrives
+# (if at all), and how long commands of a given class take to get a
+# prompt.
+#
+# If we stop waiting for the second signal and it arrives anyway, before
+# the next prompt, the real gap is recorded. The samples can be saved and
+# restored, so a new session starts with what the last one learned.
+
+import time
+from collections import deque
+
+
+def percentile(data, p):
+    """
+    The @p'th percentile (0…100) of a sorted list.
+    """
+    if not data:
+        return None
+    i = min(len(data)-1, max(0, int(round(p/100*(len(data)-1)))))
+    return data[i]
+
+
+class _Samples:
+    def __init__(self, size):
+        self.data = deque(maxlen=size)
+        self._sorted = None
+
+    def add(self, v):
+        self.data.append(v)
+        self._sorted = None
+
+    def extend(self, vs):
+        self.data.extend(vs)
+        self._sorted = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def pct(self, p):
+        if self._sorted is None:
+            self._sorted = sorted(self.data)
+        return percentile(self._sorted, p)
+
+
+class PromptTimer:
+    """
+    Collect prompt timings and derive timeouts from them.
+
+    Until @min_samples have been seen, the defaults are used.
+    """
+    def __init__(self, *, size=200, min_samples=20, gap=0.5, info=1.0, t_min=0.05, t_max=3.0):
+        self.size = size
+        self.min_samples = min_samples
+        self.default_gap = gap
+        self.default_info = info
+        self.t_min = t_min
+        self.t_max = t_max
+
+        self.gaps = _Samples(size)  # first → second signal
+        self.missed = deque(maxlen=size)  # True if the second signal didn't arrive
+        self.latency = {}  # class: send → first signal
+
+        self._cls = None
+        self._sent = None
+        self._first = None
+        self._kind = None
+        self._late = None  # (time, kind) of a first signal we timed out on
+        self.changed = False  # since the last `state` call
+
+    def _clamp(self, t):
+        return min(self.t_max, max(self.t_min, t))
+
+    def sent(self, cls):
+        """
+        A command of class @cls has been sent.
+        """
+        self._cls = cls
+        self._sent = time.monotonic()
+        self._first = None
+
+    def late(self, kind):
+        """
+        A prompt signal of type @kind arrived.
+
+        Returns True if it is the late second signal of a prompt we
+        stopped waiting for; its gap is recorded.
+        """
+        if self._late is None:
+            return False
+        t,k = self._late
+        self._late = None
+        self.changed = True
+        if kind is not None and k is not None and k != kind:
+            self.gaps.add(time.monotonic()-t)
+            self.missed.append(False)
+            return True
+        self.missed.append(True)
+        return False
+
+    def first(self, kind=None):
+        """
+        The first of the two prompt signals arrived. @kind says which
+        one it is.
+
+        Returns True if this is the late second signal of the previous
+        prompt instead. The caller should then ignore it.
+        """
+        if self.late(kind):
+            return True
+        now = time.monotonic()
+        self._first = now
+        self._kind = kind
+        if self._sent is not None:
+            try:
+                s = self.latency[self._cls]
+            except KeyError:
+                s = self.latency[self._cls] = _Samples(self.size)
+            s.add(now-self._sent)
+            self._sent = None
+            self.changed = True
+        return False
+
+    def second(self):
+        """
+        The other prompt signal arrived.
+        """
+        if self._first is None:
+            return
+        self.gaps.add(time.monotonic()-self._first)
+        self.missed.append(False)
+        self._first = None
+        self.changed = True
+
+    def timed_out(self):
+        """
+        We gave up waiting for the second signal.
+
+        It's counted as missed when the next prompt's first signal
+        arrives instead.
+        """
+        if self._first is None:
+            return
+        self._late = (self._first, self._kind)
+        self._first = None
+
+    @property
+    def gap_timeout(self):
+        """
+        How long to wait for the second prompt signal.
+        """
+        if len(self.missed) < self.min_samples:
+            return self.default_gap
+        if len(self.gaps) < len(self.missed)/10:
+            # The MUD hardly ever sends both, so don't wait for long.
+            return self.t_min
+        return self._clamp(self.gaps.pct(99)*2)
+
+    def info_timeout(self, cls=None):
+        """
+        How long to wait for a prompt after a room info arrived.
+        """
+        s = self.latency.get(cls if cls is not None else self._cls)
+        if s is None or len(s) < self.min_samples:
+            return self.default_info
+        return self._clamp(s.pct(95)*2)
+
+    def stats(self):
+        """
+        Iterate (class, n, p50, p95, p99) tuples: send-to-prompt times,
+        plus the gap between prompt signals as class "gap".
+        """
+        for k,s in sorted(self.latency.items()):
+            yield k, len(s), s.pct(50), s.pct(95), s.pct(99)
+        s = self.gaps
+        if len(s):
+            yield "gap", len(s), s.pct(50), s.pct(95), s.pct(99)
+
+    def state(self):
+        """
+        The samples, as something that can be stored as JSON.
+        """
+        self.changed = False
+        return dict(
+            gaps=[round(x, 4) for x in self.gaps.data],
+            missed=[int(x) for x in self.missed],
+            latency={k: [round(x, 4) for x in s.data] for k,s in self.latency.items()},
+        )
+
+    def load(self, state):
+        """
+        Add the samples from a previous `state`.
+        """
+        self.gaps.extend(state.get("gaps", ()))
+        self.missed.extend(bool(x) for x in state.get("missed", ()))
+        for k,v in state.get("latency", {}).items():
+            try:
+                s = self.latency[k]
+            except KeyError:
+                s = self.latency[k] = _Samples(self.size)
+            s.extend(v)
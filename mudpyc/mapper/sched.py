@@ -0,0 +1,110 @@
+# Command scheduling
+#
+# Commands for the MUD come from several sources: lines Mudlet already
+# sent, user input, the steps of running processes, and background jobs.
+# They're queued here with a priority; within a priority, the queues of
+# different owners (usually processes) are served round-robin.
+
+import time
+from collections import deque, OrderedDict
+
+import trio
+
+from mudpyc.util import attrdict
+
+SEEN = 0  # already sent (by Mudlet)
+USER = 1  # user input
+PROCESS = 2  # steps of running processes
+BACKGROUND = 3  # background jobs
+
+PRIO_NAMES = ("seen", "user", "process", "background")
+
+
+class CommandScheduler:
+    """
+    Priority queues for commands.
+
+    `get_nowait` returns the oldest item of the highest priority, rotating
+    among owners. `wait` blocks until something is queued or `kick` is
+    called.
+    """
+    def __init__(self):
+        self._q = [OrderedDict() for _ in PRIO_NAMES]  # owner > deque((item,time))
+        self._evt = trio.Event()
+        self.stats = [attrdict(n=0, wait=0.0, max=0.0) for _ in PRIO_NAMES]
+
+    def __len__(self):
+        return sum(len(d) for q in self._q for d in q.values())
+
+    def put(self, item, prio=PROCESS, owner=None):
+        q = self._q[prio]
+        try:
+            d = q[owner]
+        except KeyError:
+            d = q[owner] = deque()
+        d.append((item, time.monotonic()))
+        self._evt.set()
+
+    def has(self, prio):
+        return bool(self._q[prio])
+
+    def kick(self):
+        """
+        Wake up the sender without queueing anything.
+        """
+        self._evt.set()
+
+    @property
+    def kicked(self):
+        return self._evt.is_set()
+
+    def get_nowait(self):
+        """
+        Returns (item, priority, owner). Raises `trio.WouldBlock` if
+        nothing is queued.
+        """
+        for prio,q in enumerate(self._q):
+            if not q:
+                continue
+            owner,d = next(iter(q.items()))
+            item,t = d.popleft()
+            del q[owner]
+            if d:
+                q[owner] = d  # next time it's somebody else's turn
+            t = time.monotonic()-t
+            st = self.stats[prio]
+            st.n += 1
+            st.wait += t
+            if st.max < t:
+                st.max = t
+            return item,prio,owner
+        raise trio.WouldBlock
+
+    async def wait(self):
+        await self._evt.wait()
+        self._evt = trio.Event()
+
+    def cancel(self, owner):
+        """
+        Drop everything @owner queued. Returns the number of items.
+        """
+        n = 0
+        for q in self._q:
+            d = q.pop(owner, None)
+            if d:
+                n += len(d)
+        return n
+
+    def clear(self, *prios):
+        for p in prios:
+            self._q[p].clear()
+
+    def items(self):
+        """
+        Iterate (priority, owner, item, age) for everything queued.
+        """
+        now = time.monotonic()
+        for prio,q in enumerate(self._q):
+            for owner,d in q.items():
+                for item,t in d:
+                    yield prio,owner,item,now-t
@@ -0,0 +1,291 @@
+# Columnar map snapshot
+#
+# Rebuilding the routing graph from SQL is slow for large maps. We thus
+# save rooms, exits, costs, areas and flags as NumPy arrays in a single
+# file which is memory-mapped when loading, so startup (and offline tools)
+# don't have to wait for the database.
+#
+# The snapshot carries the database's generation counter (see
+# `SQL.generation`); if they differ the snapshot is stale and ignored.
+#
+# At startup, the snapshot fills the room cache, i.e. the graph that the
+# path finder works on. Areas and the keymap are still read from the
+# database: they're small, and they're ORM objects which we keep.
+#
+# The snapshot is written in a worker thread, which reads the database
+# with its own session. Only one task per process writes a given file.
+#
+# NumPy is optional. Without it, snapshots are simply disabled.
+
+import os
+import json
+import mmap
+import struct
+import tempfile
+
+import trio
+
+import logging
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MudPyCsn"
+VERSION = 1
+ALIGN = 64
+
+_head = struct.Struct(">8sII")  # magic, version, header length
+
+
+def _np():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def collect(sess, db):
+    """
+    Read the map's data from the database, using the session @sess.
+
+    Returns a (generation, data) tuple; the data is a dict of column
+    lists. Rooms are sorted by ID, exits by source room, so that
+    "room_exits" can index the exit columns (CSR style).
+    """
+    Room,Exit,Area,Config = db.Room,db.Exit,db.Area,db.Config
+    res = {}
+
+    f = sess.query(Config).filter(Config.name == "generation").one_or_none()
+    gen = f.value if f is not None else 0
+
+    rooms = sess.query(Room.id_old, Room.id_mudlet, Room.area_id, Room.flag,
+            Room.pos_x, Room.pos_y, Room.pos_z, Room.label).order_by(Room.id_old).all()
+    res['room_id'] = [r[0] for r in rooms]
+    res['room_mudlet'] = [r[1] or 0 for r in rooms]
+    res['room_area'] = [r[2] or 0 for r in rooms]
+    res['room_flag'] = [r[3] for r in rooms]
+    res['room_x'] = [r[4] for r in rooms]
+    res['room_y'] = [r[5] for r in rooms]
+    res['room_z'] = [r[6] for r in rooms]
+    res['room_label'] = [r[7] or "" for r in rooms]
+
+    exits = sess.query(Exit.src_id, Exit.dst_id, Exit.cost, Exit.flag).order_by(Exit.src_id).all()
+    res['exit_dst'] = [x[1] or 0 for x in exits]
+    res['exit_cost'] = [x[2] for x in exits]
+    res['exit_flag'] = [x[3] for x in exits]
+
+    ofs = []
+    i = 0
+    for r in res['room_id']:
+        while i < len(exits) and exits[i][0] < r:
+            i += 1  # dangling exit
+        ofs.append(i)
+        while i < len(exits) and exits[i][0] == r:
+            i += 1
+    ofs.append(len(exits))
+    res['room_exits'] = ofs
+
+    areas = sess.query(Area.id, Area.flag, Area.name).order_by(Area.id).all()
+    res['area_id'] = [a[0] for a in areas]
+    res['area_flag'] = [a[1] for a in areas]
+    res['area_name'] = [a[2] or "" for a in areas]
+    return gen, res
+
+
+def _collect_write(db, path):
+    # runs in a worker thread; the main session isn't thread safe
+    from sqlalchemy.orm import sessionmaker
+    sess = sessionmaker(bind=db.db.bind)()
+    try:
+        gen,data = collect(sess, db)
+    finally:
+        sess.close()
+    write(path, gen, data)
+    return gen
+
+
+def write(path, generation, data):
+    """
+    Write a snapshot. This is synchronous; run it in a thread.
+
+    The file is replaced atomically.
+    """
+    np = _np()
+    arrays = {}
+    for k,v in data.items():
+        if k.endswith(("_label","_name")):
+            arrays[k] = np.array(v, dtype=str)
+        else:
+            arrays[k] = np.array(v, dtype=np.int32)
+
+    desc = {}
+    pos = 0
+    for k,a in arrays.items():
+        desc[k] = [a.dtype.str, len(a), pos]
+        pos += (a.nbytes + ALIGN-1) // ALIGN * ALIGN
+    head = json.dumps(dict(generation=generation, arrays=desc)).encode("utf-8")
+    start = (_head.size+len(head) + ALIGN-1) // ALIGN * ALIGN
+
+    fd,tmp = tempfile.mkstemp(prefix=os.path.basename(path)+".", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_head.pack(MAGIC, VERSION, len(head)))
+            f.write(head)
+            for k,a in arrays.items():
+                f.seek(start+desc[k][2])
+                f.write(a.tobytes())
+            f.truncate(start+pos)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class MapSnapshot:
+    """
+    A loaded snapshot. Columns are read-only NumPy arrays which reference
+    the memory-mapped file, available as attributes.
+
+    Call `close` (or use it as a context manager) when you're done. The
+    columns are unusable afterwards, so don't keep references to them.
+    """
+    _mm = None
+
+    def __init__(self, path):
+        np = _np()
+        if np is None:
+            raise RuntimeError("NumPy is not available")
+        self.columns = []
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic,version,hlen = _head.unpack_from(self._mm, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a snapshot", path)
+            head = json.loads(self._mm[_head.size:_head.size+hlen])
+            start = (_head.size+hlen + ALIGN-1) // ALIGN * ALIGN
+
+            self.generation = head['generation']
+            for k,(dt,n,pos) in head['arrays'].items():
+                setattr(self, k, np.frombuffer(self._mm, dtype=dt, count=n, offset=start+pos))
+                self.columns.append(k)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        """
+        Drop the columns and unmap the file.
+        """
+        for k in self.columns:
+            delattr(self, k)
+        self.columns = []
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *tb):
+        self.close()
+
+    def exits_of(self, i):
+        """
+        Slice of the exit columns for the room at index i.
+        """
+        return slice(self.room_exits[i], self.room_exits[i+1])
+
+    def cache_entries(self):
+        """
+        Iterate (id_old, id_mudlet, label, {dst:cost}) for all rooms that
+        are in Mudlet, as used by the room cache.
+        """
+        np = _np()
+        # exits to rooms that are not in Mudlet are dropped
+        ok = np.isin(self.exit_dst, self.room_id[self.room_mudlet != 0])
+        dst = np.where(ok, self.exit_dst, 0).tolist()
+        cost = self.exit_cost.tolist()
+        ofs = self.room_exits.tolist()
+        mud = self.room_mudlet.tolist()
+        labels = self.room_label.tolist()
+        for i in np.flatnonzero(self.room_mudlet).tolist():
+            a,b = ofs[i],ofs[i+1]
+            ex = {d:c for d,c in zip(dst[a:b], cost[a:b]) if d}
+            yield self.room_id[i].item(), mud[i], labels[i] or None, ex
+
+
+def load(path, generation=None):
+    """
+    Load a snapshot if it exists and (if @generation is given) is current.
+    Returns None otherwise.
+    """
+    if _np() is None:
+        logger.warning("NumPy is not installed: map snapshots are disabled")
+        return None
+    try:
+        snap = MapSnapshot(path)
+    except FileNotFoundError:
+        return None
+    except (ValueError, struct.error) as exc:
+        logger.warning("Snapshot %s unusable: %r", path, exc)
+        return None
+    if generation is not None and snap.generation != generation:
+        logger.info("Snapshot %s is stale: %d, DB %d", path, snap.generation, generation)
+        snap.close()
+        return None
+    return snap
+
+
+def preload(db, path):
+    """
+    Fill the room cache from the snapshot at @path, if it is current.
+
+    Returns True if that worked.
+    """
+    snap = load(path, db.generation())
+    if snap is None:
+        return False
+    with snap:
+        n = db.cache_load(snap.cache_entries())
+    logger.info("Room cache: %d rooms from snapshot", n)
+    return True
+
+
+_writers = {}  # path > Event, set when that path's writer stops
+
+
+async def snapshot_writer(db, path, delay=10, retry=60):
+    """
+    Task that re-writes the snapshot some time after the database has
+    been changed.
+
+    If another task in this process already writes this file, wait for
+    it to end, then take over. If writing fails, the error is logged and
+    the snapshot is tried again after @retry seconds.
+    """
+    if _np() is None:
+        return
+    path = os.path.abspath(path)
+    while path in _writers:
+        await _writers[path].wait()
+    done = _writers[path] = trio.Event()
+    try:
+        gen = None
+        snap = load(path)
+        if snap is not None:
+            gen = snap.generation
+            snap.close()
+        while True:
+            if gen is not None:
+                await db.wait_generation(gen)
+                await trio.sleep(delay)
+            try:
+                gen = await trio.to_thread.run_sync(_collect_write, db, path)
+            except Exception:
+                logger.exception("Writing snapshot %s", path)
+                await trio.sleep(retry)
+                continue
+            logger.debug("Snapshot %d written", gen)
+    finally:
+        del _writers[path]
+        done.set()
@@ -0,0 +1,124 @@
+# Room positions
+#
+# A hash of room coordinates, per area and layer, so that we can find out
+# which rooms are at (or near) some position, or where there's room for a
+# new one, without asking Mudlet.
+#
+# Positions are bucketed into cells the size of the room grid, i.e.
+# pos_x_delta by pos_y_delta. A cell is "taken" if any room is in it.
+
+from .spiral import spiral_to
+
+
+class SpatialIndex:
+    """
+    Rooms by position: (area,z) > cell > set of room IDs.
+
+    @cell is the size of a cell, in map units: a number, or a (width,
+    height) pair.
+    """
+    def __init__(self, cell=1):
+        self.cell = self.cell_size(cell)
+        self._grid = {}  # (area,z) > (cx,cy) > set(id)
+        self._pos = {}  # id > (area,z,cx,cy)
+        self._xyz = {}  # id > (area,x,y,z)
+
+    @staticmethod
+    def cell_size(cell):
+        """
+        Normalize a cell size to a (width, height) pair.
+        """
+        if isinstance(cell, (tuple, list)):
+            w,h = cell
+        else:
+            w = h = cell
+        return max(1, w), max(1, h)
+
+    def __len__(self):
+        return len(self._pos)
+
+    def __contains__(self, rid):
+        return rid in self._pos
+
+    def _cell(self, x, y):
+        return x//self.cell[0], y//self.cell[1]
+
+    def position(self, rid):
+        """
+        The (area,x,y,z) of room @rid, or None if it's not indexed.
+        """
+        return self._xyz.get(rid)
+
+    def set(self, rid, area, x, y, z):
+        """
+        Room @rid is at this position.
+        """
+        cx,cy = self._cell(x,y)
+        pos = (area,z,cx,cy)
+        if self._pos.get(rid) != pos:
+            self.remove(rid)
+            self._pos[rid] = pos
+            try:
+                layer = self._grid[area,z]
+            except KeyError:
+                layer = self._grid[area,z] = {}
+            try:
+                layer[cx,cy].add(rid)
+            except KeyError:
+                layer[cx,cy] = {rid}
+        self._xyz[rid] = (area,x,y,z)
+
+    def remove(self, rid):
+        """
+        Room @rid is gone. Unknown rooms are ignored.
+        """
+        self._xyz.pop(rid, None)
+        try:
+            area,z,cx,cy = self._pos.pop(rid)
+        except KeyError:
+            return
+        layer = self._grid[area,z]
+        c = layer[cx,cy]
+        c.discard(rid)
+        if not c:
+            del layer[cx,cy]
+            if not layer:
+                del self._grid[area,z]
+
+    def at(self, area, x, y, z):
+        """
+        The set of rooms in the cell at this position.
+        """
+        layer = self._grid.get((area,z))
+        if not layer:
+            return set()
+        return set(layer.get(self._cell(x,y), ()))
+
+    def near(self, area, x, y, z, r=1):
+        """
+        Iterate the rooms within @r cells (Manhattan distance) of this
+        position, nearest first.
+        """
+        layer = self._grid.get((area,z))
+        if not layer:
+            return
+        cx,cy = self._cell(x,y)
+        for dx,dy in spiral_to(r):
+            c = layer.get((cx+dx,cy+dy))
+            if c:
+                yield from c
+
+    def free_near(self, area, x, y, z, r=10, ignore=None):
+        """
+        Returns the position of the free cell nearest to (@x,@y), or None
+        if there's none within @r cells. Room @ignore doesn't count.
+        """
+        layer = self._grid.get((area,z))
+        if not layer:
+            return x,y
+        cx,cy = self._cell(x,y)
+        for dx,dy in spiral_to(r):
+            c = layer.get((cx+dx,cy+dy))
+            if not c or c == {ignore}:
+                return x+dx*self.cell[0], y+dy*self.cell[1]
+        return None
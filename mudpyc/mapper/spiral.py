@@ -16,7 +16,21 @@
 # while a square has max(x,y) which isn't optimal for distributing things
 # on maps.
 
-from math import ceil as _ceil
+try:
+    from math import isqrt as _isqrt
+except ImportError:  # Python < 3.8
+    def _isqrt(n):
+        # Newton's method, on integers
+        if n < 0:
+            raise ValueError("isqrt() argument must be nonnegative")
+        if n == 0:
+            return 0
+        x = 1 << ((n.bit_length()+1)//2)
+        while True:
+            y = (x + n//x)//2
+            if y >= x:
+                return x
+            x = y
 
 def _max_at(r):
     return 2*r*(r+1)
@@ -29,8 +43,12 @@ def _max_at(r):
 # n = (-b +- sq(b*b-4*a*c))/2*a
 # n = (-1 +- sq(1+4*v/2))/2
 def _r_for(n):
-    # Given N, return the radius of the circle required to hold it
-    return _ceil((-1 + sq(1+4*n/2))/2)
+    # Given N, return the radius of the circle required to hold it.
+    # Integer square root, so that large N don't suffer from rounding.
+    r = (_isqrt(1+2*n)-1)//2
+    if _max_at(r) < n:
+        r += 1
+    return r
 
 def spiral_offset(n):
     """
@@ -1,47 +1,109 @@
 from mudpyc.util import attrdict, combine_dict
 from contextlib import contextmanager
+from functools import lru_cache
 from weakref import ref
 from heapq import heappush,heappop
+from itertools import count
 import simplejson as json
 
 from sqlalchemy import ForeignKey, Column, Integer, MetaData, Table, String, Float, Text, create_engine, select, func, Binary, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker, object_session, validates, backref
+from sqlalchemy import inspect
+from sqlalchemy.orm import relationship, sessionmaker, object_session, validates, backref, aliased
+from sqlalchemy.orm import selectinload, joinedload, deferred
 from sqlalchemy.schema import Index
 
 from typing import Dict
 
 from .const import SignalThis, SkipRoute, SkipSignal
 from .const import ENV_OK,ENV_STD,ENV_SPECIAL,ENV_UNMAPPED
+from .const import NoData
 from ..driver import LocalDir
+from .spatial import SpatialIndex
+from .feed import MapFeed, MapChanges
 
 import trio
 from contextvars import ContextVar
 
-class NoData(RuntimeError):
-    def __str__(self):
-        if self.args:
-            try:
-                return "‹NoData:{jsa}›".format(jsa=':'.join(str(x) for x in self.args))
-            except Exception:
-                pass
-        return "‹NoData›"
-    pass
-
 in_updater: ContextVar[bool] = ContextVar('in_updater', default=False)
 
-@contextmanager
-def SQL(cfg):
-    url = cfg['sql']['url']
-    sqlite = url.startswith("sqlite:")
+class _RoomCommon:
+    """
+    Abstract base class for both rooms and room caches
+    """
+    id_old:int = None
+    id_mudlet:int = None
+    label:str = None
+
+    @property
+    async def reachable(self):
+        """
+        This iterator yields room cache entries (actually, paths to
+        them) reachable from this one. The room itself is included.
+
+        This returns cache entries. Used when you only require the
+        room IDs or the room's label.
+
+        You must send a `mudpyc.mapper.const._PathSignal` instance back
+        to the iterator, to tell it what to do next.
+        """
+        # the counter breaks ties, rooms can't be compared
+        tick = count(1)
+        res = [(0,0,[self])]
+        seen = set()
+        c = None
+        while res:
+            d,t,h = heappop(res)
+            r = h[-1]
+            if r.id_old in seen:
+                continue
+            seen.add(r.id_old)
+
+            for rr,cc in r.exit_costs:
+                heappush(res,(d+cc, next(tick), h+[rr]))
+
+            c = (yield h)
+            if c.done:
+                return
+            if c.skip:
+                continue
+
+    @property
+    def cache(self):
+        """
+        Cache entry for this room
+        """
+        ...
+
+    @property
+    def exit_costs(self):
+        """
+        (next_room,cost) iterator
+        """
+        ...
+
+class _AddOn:
+    @property
+    def _s(self):
+        return object_session(self)
+    @property
+    def _m(self):
+        return self._s._mud__main()
+    @property
+    def _db(self):
+        return self._s._main()
+
+
+@lru_cache(maxsize=None)
+def _models(sqlite):
+    """
+    Build the ORM classes. They only depend on the database's dialect,
+    so this only happens once per process.
+    """
     _idx={}
     if not sqlite:
         _idx['index'] = True
 
-    engine = create_engine(
-            url,
-            #strategy=TRIO_STRATEGY
-    )
     convention = {
         "ix": 'ix_%(column_0_label)s',
         "uq": "uq_%(table_name)s_%(column_0_name)s",
@@ -51,128 +113,6 @@ def SQL(cfg):
     }
     Base = declarative_base(metadata=MetaData(naming_convention=convention))
 
-    room_cache = {}
-    _cache_todo = set()  # rooms to be processed
-    _cache_evt = trio.Event()  # set when there are rooms to be processed
-
-    class _RoomCommon:
-        """
-        Abstract base class for both rooms and room caches
-        """
-        id_old:int = None
-        id_mudlet:int = None
-        label:str = None
-
-        @property
-        async def reachable(self):
-            """
-            This iterator yields room cache entries (actually, paths to
-            them) reachable from this one. The room itself is included.
-
-            This returns cache entries. Used when you only require the
-            room IDs or the room's label.
-
-            You must send a `mudpyc.mapper.const._PathSignal` instance back
-            to the iterator, to tell it what to do next.
-            """
-            res = [(0,[self])]
-            seen = set()
-            c = None
-            while res:
-                d,h = heappop(res)
-                r = h[-1]
-                if r.id_old in seen:
-                    continue
-                seen.add(r.id_old)
-
-                for rr,cc in r.exit_costs:
-                    heappush(res,(d+cc, h+[rr]))
-
-                c = (yield h)
-                if c.done:
-                    return
-                if c.skip:
-                    continue
-
-        @property
-        def cache(self):
-            """
-            Cache entry for this room
-            """
-            ...
-
-        @property
-        def exit_costs(self):
-            """
-            (next_room,cost) iterator
-            """
-            ...
-
-    class CachedRoom(_RoomCommon):
-        id_old = None
-        id_mudlet = None
-        label = None
-
-        def __new__(cls, room):
-            if not room.id_mudlet:
-                return None
-            try:
-                res = room_cache[room.id_mudlet]
-            except KeyError:
-                res = object.__new__(cls)
-            else:
-                res._reset(room)
-            return res
-
-        def __init__(self, room):
-            if self.id_old is not None:
-                return
-            self.id_mudlet = room.id_mudlet
-            self.id_old = room.id_old
-            self.reset()
-            room_cache[self.id_old] = self
-
-        @property
-        def cache(self):
-            return self
-
-        def reset(self):
-            dr = r_mudlet(self.id_mudlet)
-            self._reset(dr)
-
-        def _reset(self, room):
-            self._exits = {}
-            self.label = room.label
-            for x in room.exits:
-                if x.dst is None or not x.dst.id_mudlet:
-                    continue
-                self._exits[x.dst.id_mudlet] = x.cost
-
-        @property
-        def exit_costs(self):
-            """
-            cache>cost iterator
-            """
-            for d,c in self._exits.items():
-                if d in room_cache:
-                    dc = room_cache[d]
-                else:
-                    try:
-                        r = r_old(d)
-                    except KeyError:
-                        continue
-                    dc = CachedRoom(r)
-                yield dc,c
-
-
-    class _AddOn:
-        @property
-        def _s(self):
-            return object_session(self)
-        @property
-        def _m(self):
-            return self._s._mud__main()
-
     assoc_skip_room = Table('assoc_skip_room', Base.metadata,
         Column('skip_id', Integer, ForeignKey('skip.id')),
         Column('room_id', Integer, ForeignKey('rooms.id_old'), **_idx),
@@ -208,7 +148,8 @@ def SQL(cfg):
         
         @value.setter
         def value(self, value):
-            self._value = json.dumps(value)
+            # SQLite refuses str for binary columns
+            self._value = json.dumps(value).encode("utf-8")
 
     class Keymap(_AddOn, Base):
         __tablename__ = "keys"
@@ -327,6 +268,17 @@ def SQL(cfg):
         long_descr = relationship("LongDescr", uselist=False, cascade="delete")
         note = relationship("Note", uselist=False, cascade="delete")
 
+        def texts(self):
+            """
+            This room's long description and note, or None.
+
+            Both texts are deferred, so that checking whether a room has
+            them doesn't load them. This reads both with one query.
+            """
+            return self._s.query(LongDescr.descr, Note.note).select_from(Room) \
+                .outerjoin(Room.long_descr).outerjoin(Room.note) \
+                .filter(Room.id_old == self.id_old).one()
+
         @validates("id_mudlet")
         def mudlet_ok(self, key, id) -> str:
             if id is not None and id < 0:
@@ -341,7 +293,7 @@ def SQL(cfg):
 
         @property
         def cache(self):
-            return room_cache[self.id_old]
+            return self._db.room_cache[self.id_old]
 
         @property
         def exit_costs(self):
@@ -381,19 +333,19 @@ def SQL(cfg):
 
         def next_word(self):
             while True:
-                res = session.query(WordRoom).filter(WordRoom.room_id==self.id_old, WordRoom.flag == 0).first()
+                res = self._s.query(WordRoom).filter(WordRoom.room_id==self.id_old, WordRoom.flag == 0).first()
                 if res is not None:
-                    wa = session.query(WordAlias).filter(WordAlias.name == res.word.name).one_or_none()
+                    wa = self._s.query(WordAlias).filter(WordAlias.name == res.word.name).one_or_none()
                     if wa is not None:
-                        session.delete(res)
+                        self._s.delete(res)
                         continue
-                session.commit()
+                self._s.commit()
                 return res
 
         def reset_words(self):
-            for wr in session.query(WordRoom).filter(WordRoom.room_id==self.id_old, WordRoom.flag == 1).all():
+            for wr in self._s.query(WordRoom).filter(WordRoom.room_id==self.id_old, WordRoom.flag == 1).all():
                 wr.flag = 0
-            session.commit()
+            self._s.commit()
 
 
         def set_id_mudlet(self, id_mudlet):
@@ -413,13 +365,13 @@ def SQL(cfg):
             Return the WordRoom entry for this word, if known.
             """
             if isinstance(word, str):
-                word = get_word(word, create=create)
+                word = self._db.word(word, create=create)
                 if word is None:
                     return None
-            res = session.query(WordRoom).filter(WordRoom.room_id==self.id_old,WordRoom.word_id==word.id).one_or_none()
+            res = self._s.query(WordRoom).filter(WordRoom.room_id==self.id_old,WordRoom.word_id==word.id).one_or_none()
             if res is None and create:
                 res = WordRoom(word=word, room=self)
-                session.add(res)
+                self._s.add(res)
             return res
 
         @property
@@ -442,7 +394,7 @@ def SQL(cfg):
             return ":"+":".join(ex)+":"
 
         def visited(self):
-            lv = session.query(func.max(Room.last_visit)).scalar() or 0
+            lv = self._s.query(func.max(Room.last_visit)).scalar() or 0
             if self.last_visit != lv:
                 self.last_visit = lv+1
 
@@ -592,7 +544,7 @@ def SQL(cfg):
                 else:
                     x.flag &=~ Exit.F_IN_MUDLET
 
-            update_cache(self)
+            self._db.update_cache(self)
             self._s.commit()
 
             return x,changed
@@ -656,12 +608,12 @@ def SQL(cfg):
                             pass # await mud.addSpecialExit(self.id_mudlet,0,d) # ?
                         changed = True
 
-            await mud.setRoomEnv(self.id_mudlet, ENV_OK+self.open_exits)
+            m.room_color_dirty(self)
             return changed
 
 
         def has_thing(self, txt):
-            t = get_thing(txt)
+            t = self._db.thing(txt)
             self.things.append(t)
 
 
@@ -670,46 +622,11 @@ def SQL(cfg):
                 other = other.id_old
                 return self.id_old < other
 
-    def update_cache(room):
-        if in_updater.get():
-            return
-        if room.id_old not in _cache_todo:
-            _cache_todo.add(room.id_old)
-            _cache_evt.set()
-
-    async def cache_updater():
-        # standard decorator style
-        nonlocal _cache_evt
-        in_updater.set(True)
-
-        @event.listens_for(Room, 'load')
-        def receive_load(room, context):
-            "listen for the 'load' event"
-            if room.id_old not in room_cache:
-                update_cache(room)
-
-        evts = []
-        while True:
-            if not _cache_todo:
-                await _cache_evt.wait()
-                _cache_evt = trio.Event()
-
-            while _cache_todo:
-                await trio.sleep(0)
-                r = _cache_todo.pop()
-
-                try:
-                    room = r_old(r)
-                except NoData:
-                    pass # deleted
-                else:
-                    CachedRoom(room)
-
     class LongDescr(_AddOn, Base):
         __tablename__ = "longdescr"
         id = Column(Integer, nullable=True, primary_key=True)
         room_id = Column(Integer, ForeignKey("rooms.id_old", onupdate="CASCADE",ondelete="RESTRICT"), nullable=False, **_idx)
-        descr = Column(Text, nullable=False)
+        descr = deferred(Column(Text, nullable=False))
 
 #        room = relationship("Room", uselist=False,
 #            primaryjoin=id == Room.id_old, foreign_keys=[Room.id_old])
@@ -751,7 +668,7 @@ def SQL(cfg):
         __tablename__ = "notes"
         id = Column(Integer, nullable=True, primary_key=True)
         room_id = Column(Integer, ForeignKey("rooms.id_old", onupdate="CASCADE",ondelete="RESTRICT"), nullable=False, **_idx)
-        note = Column(Text, nullable=False)
+        note = deferred(Column(Text, nullable=False))
 
 #        room = relationship("Room", uselist=False,
 #            primaryjoin=id == Room.id_old, foreign_keys=[Room.id_old])
@@ -779,7 +696,7 @@ def SQL(cfg):
             if w is None:
                 import pdb;pdb.set_trace()
             if isinstance(w,str):
-                w = get_word(w, create=True)
+                w = self._db.word(w, create=True)
             if w is self:
                 raise RuntimeError("Cannot replace with myself")
             if w._alias_for is not None:
@@ -790,10 +707,10 @@ def SQL(cfg):
                     # Original not known: update entry
                     wr.word = w
                 else:
-                    session.delete(wr)
+                    self._s.delete(wr)
             wa = WordAlias(name=self.name, word=w)
-            session.delete(self)
-            session.add(wa)
+            self._s.delete(self)
+            self._s.add(wa)
             self._alias_for = w
             return w
 
@@ -824,7 +741,7 @@ def SQL(cfg):
             Replace it.
             """
             ww = self.word.alias_for(w)
-            return session.query(WordRoom).filter(Room.id_old == self.room.id_old, Word.id == ww.id).one_or_none()
+            return self._s.query(WordRoom).filter(Room.id_old == self.room.id_old, Word.id == ww.id).one_or_none()
 
     class Quest(_AddOn, Base):
         __tablename__ = "quest"
@@ -842,18 +759,18 @@ def SQL(cfg):
         def add_step(self, **kw):
             step = self.last_step_nr +1
             qs = QuestStep(quest_id=self.id, step=step, **kw)
-            session.add(qs)
+            self._s.add(qs)
             return qs
 
         @property
         def last_step_nr(self):
-            return session.query(func.max(QuestStep.step)).filter(QuestStep.quest==self).scalar() or 0
+            return self._s.query(func.max(QuestStep.step)).filter(QuestStep.quest==self).scalar() or 0
         def step_at(self, nr=None):
             if nr is None:
                 nr = self.step
                 if nr is None:
                     return None
-            return session.query(QuestStep).filter(QuestStep.quest_id == self.id, QuestStep.step==nr).one_or_none()
+            return self._s.query(QuestStep).filter(QuestStep.quest_id == self.id, QuestStep.step==nr).one_or_none()
 
         @property
         def current_step(self):
@@ -885,7 +802,7 @@ def SQL(cfg):
             # at first we always move the current step to the end
             if step is not None and step == self.step:
                 return
-            nsteps = (session.query(func.max(Room.last_visit)).scalar() or 0)+1
+            nsteps = (self._s.query(func.max(Room.last_visit)).scalar() or 0)+1
             if step is None:
                 step = nsteps
             elif step >= nsteps: # don't put beyond the end
@@ -894,34 +811,268 @@ def SQL(cfg):
 
             if ostep < step:
                 # move stuff down
-                session.query(QuestStep).filter(QuestStep.quest_id == self.quest_id, QuestStep.step > ostep, QuestStep.step <= step).update({QuestStep.step:QuestStep.step-1})
+                self._s.query(QuestStep).filter(QuestStep.quest_id == self.quest_id, QuestStep.step > ostep, QuestStep.step <= step).update({QuestStep.step:QuestStep.step-1})
             else:
                 # move stuff up
-                session.query(QuestStep).filter(QuestStep.quest_id == self.quest_id, QuestStep.step >= step, QuestStep.step < ostep).update({QuestStep.step:QuestStep.step+1})
+                self._s.query(QuestStep).filter(QuestStep.quest_id == self.quest_id, QuestStep.step >= step, QuestStep.step < ostep).update({QuestStep.step:QuestStep.step+1})
             self.step = step
-            session.commit()
+            self._s.commit()
 
         def delete(self):
             step = self.step
-            session.delete(self)
-            session.query(QuestStep).filter(QuestStep.quest_id == self.quest_id, QuestStep.step > step).update({QuestStep.step:QuestStep.step-1})
-            session.commit()
+            self._s.delete(self)
+            self._s.query(QuestStep).filter(QuestStep.quest_id == self.quest_id, QuestStep.step > step).update({QuestStep.step:QuestStep.step-1})
+            self._s.commit()
+
 
+    return attrdict(Base=Base, Area=Area, Config=Config, Keymap=Keymap,
+            Exit=Exit, Room=Room, LongDescr=LongDescr, Thing=Thing,
+            Feature=Feature, Note=Note, Skiplist=Skiplist, Word=Word,
+            WordAlias=WordAlias, WordRoom=WordRoom, Quest=Quest,
+            QuestStep=QuestStep)
 
-    def r_old(room):
-        res = session.query(Room).filter(Room.id_old == room).one_or_none()
+
+@contextmanager
+def SQL(cfg):
+    url = cfg['sql']['url']
+    sqlite = url.startswith("sqlite:")
+    m = _models(sqlite)
+    Area,Config,Keymap,Exit,Room = m.Area,m.Config,m.Keymap,m.Exit,m.Room
+    LongDescr,Thing,Feature,Note = m.LongDescr,m.Thing,m.Feature,m.Note
+    Skiplist,Word,WordAlias,WordRoom = m.Skiplist,m.Word,m.WordAlias,m.WordRoom
+    Quest,QuestStep = m.Quest,m.QuestStep
+
+    engine = create_engine(
+            url,
+            #strategy=TRIO_STRATEGY
+    )
+    room_cache = {}
+    _cache_todo = set()  # rooms to be processed
+    _cache_evt = trio.Event()  # set when there are rooms to be processed
+
+    class CachedRoom(_RoomCommon):
+        id_old = None
+        id_mudlet = None
+        label = None
+
+        def __new__(cls, room):
+            if not room.id_mudlet:
+                return None
+            try:
+                res = room_cache[room.id_old]
+            except KeyError:
+                res = object.__new__(cls)
+            else:
+                res._reset(room)
+            return res
+
+        def __init__(self, room):
+            if self.id_old is not None:
+                return
+            self.id_mudlet = room.id_mudlet
+            self.id_old = room.id_old
+            self.reset()
+            room_cache[self.id_old] = self
+
+        @property
+        def cache(self):
+            return self
+
+        def reset(self):
+            dr = r_mudlet(self.id_mudlet)
+            self._reset(dr)
+
+        def _reset(self, room):
+            self._exits = {}
+            self.label = room.label
+            for x in room.exits:
+                if x.dst is None or not x.dst.id_mudlet:
+                    continue
+                self._exits[x.dst_id] = x.cost
+
+        @property
+        def exit_costs(self):
+            """
+            cache>cost iterator
+            """
+            for d,c in self._exits.items():
+                if d in room_cache:
+                    dc = room_cache[d]
+                else:
+                    try:
+                        r = r_old(d)
+                    except NoData:
+                        continue
+                    dc = CachedRoom(r)
+                yield dc,c
+
+
+    def update_cache(room):
+        if in_updater.get():
+            return
+        if room.id_old not in _cache_todo:
+            _cache_todo.add(room.id_old)
+            _cache_evt.set()
+
+    async def cache_updater():
+        nonlocal _cache_evt
+        in_updater.set(True)
+
+        # The model classes are shared, thus filter on our session
+        def receive_load(room, context):
+            "listen for the 'load' event"
+            if context.session is session and room.id_old not in room_cache:
+                update_cache(room)
+        event.listen(Room, 'load', receive_load)
+
+        try:
+            while True:
+                if not _cache_todo:
+                    await _cache_evt.wait()
+                    _cache_evt = trio.Event()
+
+                while _cache_todo:
+                    await trio.sleep(0)
+                    r = _cache_todo.pop()
+
+                    try:
+                        room = r_old(r)
+                    except NoData:
+                        pass # deleted
+                    else:
+                        CachedRoom(room)
+        finally:
+            event.remove(Room, 'load', receive_load)
+
+    def cache_load(entries):
+        """
+        Pre-fill the room cache, e.g. from a snapshot.
+
+        @entries is an iterable of (id_old, id_mudlet, label, {dst:cost})
+        tuples. Returns the number of rooms.
+        """
+        n = 0
+        for id_old,id_mudlet,label,exits in entries:
+            c = object.__new__(CachedRoom)
+            c.id_old = id_old
+            c.id_mudlet = id_mudlet
+            c.label = label
+            c._exits = exits
+            room_cache[id_old] = c
+            n += 1
+        return n
+
+    # Loading profiles. Displaying a room touches its exits and their
+    # destinations, which are loaded lazily, one query per access. These
+    # options load them with a couple of queries instead.
+    #   exits: the room's exits and their destinations
+    #          (info_str, exit_str, open_exits, exit_at, exit_to)
+    #   neighbours: also the destinations' exits, plus features
+    #          (exit lists, Exit.back_feature)
+    #   sources: exits leading here, and their sources' exits
+    profiles = dict(
+        plain=(),
+        exits=(
+            selectinload(Room.exits).joinedload(Exit.dst),
+        ),
+        neighbours=(
+            selectinload(Room.exits).joinedload(Exit.feature),
+            selectinload(Room.exits).joinedload(Exit.dst)
+                .selectinload(Room.exits).joinedload(Exit.dst),
+            selectinload(Room.exits).joinedload(Exit.dst)
+                .selectinload(Room.exits).joinedload(Exit.feature),
+        ),
+        sources=(
+            selectinload(Room.r_exits).joinedload(Exit.src)
+                .selectinload(Room.exits).joinedload(Exit.dst),
+        ),
+    )
+
+    def q_room(profile="exits"):
+        """
+        A room query with this loading profile.
+        """
+        return session.query(Room).options(*profiles[profile])
+
+    def rooms(rooms, profile="exits"):
+        """
+        Load these rooms (Room objects or id_old values) with this
+        loading profile. Returns a list in the same order.
+        """
+        ids = [getattr(r, "id_old", r) for r in rooms]
+        res = {}
+        for i in range(0, len(ids), 500):
+            for r in q_room(profile).filter(Room.id_old.in_(ids[i:i+500])):
+                res[r.id_old] = r
+        return [res[i] for i in ids if i in res]
+
+    def r_old(room, profile="exits"):
+        res = q_room(profile).filter(Room.id_old == room).one_or_none()
         if res is None:
             raise NoData("id_old",room)
         return res
 
-    def r_mudlet(room):
-        res = session.query(Room).filter(Room.id_mudlet == room).one_or_none()
+    def room_envs(is_std_dir, rooms=None):
+        """
+        Returns a Mudlet ID > ENV_* dict for all mapped rooms, or for those
+        in @rooms (Room objects or id_old values), the same as
+        ``ENV_OK+room.open_exits`` but with one query instead of loading
+        each room's exits and their destinations.
+        """
+        Dst = aliased(Room)
+        q = session.query(Room.id_mudlet, Exit.dir, Exit.dst_id, Dst.id_mudlet) \
+                .select_from(Room) \
+                .outerjoin(Exit, Exit.src_id == Room.id_old) \
+                .outerjoin(Dst, Exit.dst_id == Dst.id_old) \
+                .filter(Room.id_mudlet != None)
+        if rooms is not None:
+            rooms = [r.id_old if isinstance(r,Room) else r for r in rooms]
+            q = q.filter(Room.id_old.in_(rooms))
+
+        res = {}
+        for r,d,dst,dst_m in q:
+            v = res.get(r, 0)
+            if d is None or v == 3:
+                pass
+            elif dst is None:
+                v = max(v, 1 if is_std_dir(d) else 2)
+            elif dst_m is None:
+                v = 3
+            res[r] = v
+        return { r:ENV_OK+v for r,v in res.items() }
+
+    def map_rows():
+        """
+        Returns a Mudlet ID > (x, y, z, area, name, [(dir, dst)]) dict for
+        all mapped rooms, with one query. Only exits whose destination is
+        mapped are included; @dst is its Mudlet ID.
+        """
+        Dst = aliased(Room)
+        q = session.query(Room.id_mudlet, Room.pos_x, Room.pos_y, Room.pos_z, Room.area_id, Room.name,
+                    Exit.dir, Dst.id_mudlet) \
+                .select_from(Room) \
+                .outerjoin(Exit, Exit.src_id == Room.id_old) \
+                .outerjoin(Dst, Exit.dst_id == Dst.id_old) \
+                .filter(Room.id_mudlet != None)
+        res = {}
+        for r,x,y,z,area,name,d,dst in q:
+            try:
+                ex = res[r][5]
+            except KeyError:
+                ex = []
+                res[r] = (x,y,z,area,name,ex)
+            if d is not None and dst is not None:
+                ex.append((d,dst))
+        return res
+
+    def r_mudlet(room, profile="exits"):
+        res = q_room(profile).filter(Room.id_mudlet == room).one_or_none()
         if res is None:
             raise NoData("id_mudlet",room)
         return res
 
-    def r_hash(room):
-        res = session.query(Room).filter(Room.id_gmcp == room).one_or_none()
+    def r_hash(room, profile="exits"):
+        res = q_room(profile).filter(Room.id_gmcp == room).one_or_none()
         if res is None:
             raise NoData("id_hash",room)
         if res.flag & Room.F_NO_GMCP_ID:
@@ -996,33 +1147,274 @@ def SQL(cfg):
             f = session.query(Config).filter(Config.name == name).one_or_none()
             if f is None:
                 f = Config(name=name)
-                f.value = value
                 session.add(f)
+            f.value = value
             session.commit()
             self._cache[name] = value
 
     def setup(server):
         session._mud__main = ref(server)
 
+    # The generation counter is incremented whenever a transaction
+    # changes the map, i.e. rooms (other than their visit counter),
+    # exits or areas. Snapshots use it to detect staleness.
+    _gen = attrdict(value=None, bumped=False, evt=trio.Event())
+    _gen_attrs = {"id_mudlet","label","area_id","flag","pos_x","pos_y","pos_z"}
+
+    def generation():
+        if _gen.value is None:
+            f = session.query(Config).filter(Config.name == "generation").one_or_none()
+            _gen.value = f.value if f is not None else 0
+        return _gen.value
+
+    async def wait_generation(gen):
+        """
+        Wait until the map's generation is no longer @gen.
+        """
+        while generation() == gen:
+            await _gen.evt.wait()
+
+    def _map_changed(sess):
+        for obj in sess.new:
+            if isinstance(obj, (Room, Exit, Area)):
+                return True
+        for obj in sess.deleted:
+            if isinstance(obj, (Room, Exit, Area)):
+                return True
+        for obj in sess.dirty:
+            if isinstance(obj, (Exit, Area)):
+                if sess.is_modified(obj):
+                    return True
+            elif isinstance(obj, Room):
+                attrs = inspect(obj).attrs
+                if any(attrs[a].history.has_changes() for a in _gen_attrs):
+                    return True
+        return False
+
+    def _bump_generation(sess, ctx, instances):
+        if _gen.bumped or not _map_changed(sess):
+            return
+        with sess.no_autoflush:
+            f = sess.query(Config).filter(Config.name == "generation").one_or_none()
+            if f is None:
+                f = Config(name="generation")
+                f.value = 0
+                sess.add(f)
+            f.value = f.value+1
+        _gen.value = f.value
+        _gen.bumped = True
+
+    # Changes are collected per transaction and published to the other
+    # servers using this database when it's committed.
+    feed = MapFeed.for_url(url)
+    _feed_attrs = _gen_attrs | {"name"}
+    _changes = attrdict(value=MapChanges())
+
+    def _collect_changes(sess, ctx):
+        ch = _changes.value
+        for obj in sess.new:
+            if isinstance(obj, Room):
+                ch.rooms[obj.id_old] = "new"
+            elif isinstance(obj, Exit):
+                ch.exits.add(obj.src_id)
+            elif isinstance(obj, Area):
+                ch.areas.add(obj.id)
+        for obj in sess.dirty:
+            if isinstance(obj, Room):
+                attrs = inspect(obj).attrs
+                if any(attrs[a].history.has_changes() for a in _feed_attrs):
+                    ch.rooms.setdefault(obj.id_old, "mod")
+            elif isinstance(obj, Exit):
+                if sess.is_modified(obj):
+                    ch.exits.add(obj.src_id)
+            elif isinstance(obj, Area):
+                if sess.is_modified(obj):
+                    ch.areas.add(obj.id)
+        for obj in sess.deleted:
+            if isinstance(obj, Room):
+                ch.rooms.pop(obj.id_old, None)
+                ch.deleted[obj.id_old] = obj.id_mudlet
+            elif isinstance(obj, Exit):
+                ch.exits.add(obj.src_id)
+            elif isinstance(obj, Area):
+                ch.areas.add(obj.id)
+
+    def _committed(sess):
+        if _gen.bumped:
+            _gen.bumped = False
+            _gen.evt.set()
+            _gen.evt = trio.Event()
+        ch = _changes.value
+        if ch:
+            _changes.value = MapChanges()
+            ch.exits -= set(ch.deleted)
+            ch.generation = _gen.value
+            feed.publish(sess, ch)
+
+    def _rolled_back(sess, previous_transaction):
+        _changes.value = MapChanges()
+        if _gen.bumped:
+            _gen.bumped = False
+            _gen.value = None
+
+    def trace(tracer):
+        """
+        Record the time taken by SQL statements in @tracer.
+        """
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("_trace", []).append(tracer.now())
+
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            t = conn.info["_trace"].pop()
+            name = " ".join(statement.split()[:4])
+            tracer.add(name, "sql", t, lane="sql", sql=statement[:200])
+
+        event.listen(engine, "before_cursor_execute", _before)
+        event.listen(engine, "after_cursor_execute", _after)
+
+    # Positions of mapped rooms. Rooms whose position changes are noted
+    # and re-indexed when the index is next used.
+    _spatial = attrdict(index=None, dirty=set())
+
+    def spatial(cell=1):
+        """
+        The `SpatialIndex` of mapped rooms, using this cell size
+        (a number or a (width, height) pair).
+        """
+        sp = _spatial.index
+        if sp is None or sp.cell != SpatialIndex.cell_size(cell):
+            sp = SpatialIndex(cell)
+            q = session.query(Room.id_old, Room.area_id, Room.pos_x, Room.pos_y, Room.pos_z) \
+                    .filter(Room.id_mudlet != None)
+            for rid,area,x,y,z in q:
+                sp.set(rid, area, x,y,z)
+            _spatial.index = sp
+            _spatial.dirty = set()
+        elif _spatial.dirty:
+            dirty,_spatial.dirty = _spatial.dirty,set()
+            for r in dirty:
+                st = inspect(r)
+                if st.deleted or st.detached:
+                    if st.identity:
+                        sp.remove(st.identity[0])
+                elif r.id_old is None:
+                    _spatial.dirty.add(r)  # not flushed yet
+                elif r.id_mudlet is None:
+                    sp.remove(r.id_old)
+                else:
+                    sp.set(r.id_old, r.area_id, r.pos_x or 0, r.pos_y or 0, r.pos_z or 0)
+        return sp
+
+    # The model classes are shared, thus filter on our session.
+    # New rooms are caught when they're added to it.
+    def _room_moved(target, value, oldvalue, initiator):
+        if _spatial.index is not None and object_session(target) is session:
+            _spatial.dirty.add(target)
+
+    def _room_added(sess, obj):
+        if _spatial.index is not None and isinstance(obj, Room):
+            _spatial.dirty.add(obj)
+
+    def _room_deleted(sess, obj):
+        if _spatial.index is not None and isinstance(obj, Room):
+            _spatial.index.remove(obj.id_old)
+
+    _moved_attrs = (Room.pos_x, Room.pos_y, Room.pos_z, Room.area_id, Room.id_mudlet)
+    for attr in _moved_attrs:
+        event.listen(attr, "set", _room_moved)
+
+    stats = attrdict(queries=0)
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        stats.queries += 1
+    event.listen(engine, "before_cursor_execute", _count)
+
+    def apply_changes(ch):
+        """
+        Another server changed the map. Forget what we know about the
+        affected objects so that they're re-read, and update the caches.
+
+        Returns the rooms which still exist.
+        """
+        im = session.identity_map
+        def _known(cls, id):
+            return im.get(inspect(cls).identity_key_from_primary_key((id,)))
+
+        _gen.value = None
+        _gen.evt.set()
+        _gen.evt = trio.Event()
+
+        for rid in ch.deleted:
+            room_cache.pop(rid, None)
+            if _spatial.index is not None:
+                _spatial.index.remove(rid)
+            r = _known(Room, rid)
+            if r is not None:
+                session.expunge(r)
+        if ch.deleted:
+            # the database has cleared these exits' destinations
+            for obj in list(im.values()):
+                if isinstance(obj, Exit) and obj.dst_id in ch.deleted:
+                    session.expire(obj)
+                    ch.exits.add(obj.src_id)
+
+        for aid in ch.areas:
+            a = _known(Area, aid)
+            if a is not None:
+                session.expire(a)
+
+        res = []
+        for rid in set(ch.rooms) | ch.exits:
+            r = _known(Room, rid)
+            if r is not None:
+                session.expire(r)
+            try:
+                r = r_old(rid)
+            except NoData:
+                continue
+            if rid in ch.exits:
+                for x in r.exits:
+                    session.expire(x)
+            if rid in room_cache:
+                update_cache(r)
+            if _spatial.index is not None:
+                _spatial.dirty.add(r)
+            res.append(r)
+        return res
+
     Session=sessionmaker(bind=engine)
     #conn = await engine.connect()
     session=Session()
+    event.listen(session, "before_flush", _bump_generation)
+    event.listen(session, "after_commit", _committed)
+    event.listen(session, "after_soft_rollback", _rolled_back)
+    event.listen(session, "transient_to_pending", _room_added)
+    event.listen(session, "persistent_to_deleted", _room_deleted)
+    event.listen(session, "after_flush", _collect_changes)
     res = attrdict(db=session, q=session.query,
-            setup=setup, cache_updater=cache_updater,
+            setup=setup, cache_updater=cache_updater, cache_load=cache_load,
+            room_cache=room_cache, update_cache=update_cache,
+            generation=generation, wait_generation=wait_generation,
+            trace=trace,
             Room=Room, Area=Area, Exit=Exit, Skiplist=Skiplist, Quest=Quest,
             Thing=Thing, Feature=Feature, LongDescr=LongDescr, Note=Note,
-            Keymap=Keymap,
+            Keymap=Keymap, Config=Config,
             r_hash=r_hash, r_old=r_old, r_mudlet=r_mudlet, r_new=r_new,
+            room_envs=room_envs, rooms=rooms, q_room=q_room, map_rows=map_rows,
+            profiles=profiles, stats=stats, spatial=spatial,
+            feed=feed, apply_changes=apply_changes,
             skiplist=get_skiplist, word=get_word, thing=get_thing,
             quest=get_quest, feature=get_feature,
             cfg=Cfg(),
             commit=session.commit, rollback=session.rollback,
-            add=session.add, delete=session.delete,
+            add=session.add, delete=session.delete, func=func,
             WF_SCANNED=1, WF_SKIP=2, WF_IMPORTANT=3,
             )
     session._main = ref(res)
     try:
         yield res
     finally:
+        for attr in _moved_attrs:
+            event.remove(attr, "set", _room_moved)
         session.close()
 
@@ -69,12 +69,9 @@ class FulltextChecker(PathChecker):
         super().__init__(**kw)
 
     async def check(self, room):
-        n = room.long_descr
-        if n and self.txt in n.descr.lower():
-            return SkipSignal
-        n = room.note
-        if n and self.txt in n.note.lower():
-            return SkipSignal
+        for n in room.texts():
+            if n and self.txt in n.lower():
+                return SkipSignal
 
 class VisitChecker(PathChecker):
     def __init__(self, last_visit, **kw):
@@ -0,0 +1,209 @@
+# Sampling profiler
+#
+# A thread looks at the main thread's stack every few milliseconds and
+# counts the stacks it sees. This works in a running client, costs next
+# to nothing when it's off and little when it's on, and needs no
+# reconnect.
+#
+# All trio tasks run in one thread. While sampling, a trio Instrument
+# records which task is being stepped; the runner's frame is replaced by
+# that task's name, so stacks are grouped by task. Time spent waiting for
+# I/O shows up as "(idle)".
+#
+# The result can be written as collapsed stacks ("a;b;c 42" lines, for
+# flamegraph.pl or https://www.speedscope.app) or as a pstats file.
+
+import os
+import sys
+import time
+import marshal
+import threading
+from collections import Counter
+
+import trio
+
+_IDLE = ("~", 0, "(idle)")
+
+
+def _trio_io(code):
+    # waiting for I/O or a timeout
+    return os.sep+"trio"+os.sep+"_core"+os.sep+"_io_" in code.co_filename
+
+
+def _trio_runner(code):
+    return code.co_name == "unrolled_run" and "trio" in code.co_filename
+
+
+class Sampler(trio.abc.Instrument):
+    """
+    Sample the stack of the thread that created this object, which must
+    be running trio.
+
+    @interval is in seconds.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()  # stack (outermost first) > count
+        self.started = None
+        self.stopped = None
+        self._tid = threading.get_ident()
+        self._thread = None
+        self._halt = threading.Event()
+        self._lock = threading.Lock()
+        self._task = None  # the task trio is currently stepping
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    @property
+    def n_samples(self):
+        return sum(self._snapshot().values())
+
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError("The profiler is already running")
+        self._halt.clear()
+        self.started = time.time()
+        self.stopped = None
+        trio.lowlevel.add_instrument(self)
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        """
+        Stop sampling. Returns False if it wasn't running.
+        """
+        thread,self._thread = self._thread,None
+        if thread is None:
+            return False
+        trio.lowlevel.remove_instrument(self)
+        self._task = None
+        self._halt.set()
+        await trio.to_thread.run_sync(thread.join)
+        self.stopped = time.time()
+        return True
+
+    # Instrument hooks. They run in the trio thread; the sampler only
+    # reads the attribute.
+
+    def before_task_step(self, task):
+        self._task = task
+
+    def after_task_step(self, task):
+        self._task = None
+
+    def clear(self):
+        with self._lock:
+            self.samples.clear()
+
+    def _run(self):
+        while not self._halt.wait(self.interval):
+            f = sys._current_frames().get(self._tid)
+            if f is None:
+                return
+            st = self._stack(f, self._task)
+            with self._lock:
+                self.samples[st] += 1
+
+    def _stack(self, f, task):
+        if _trio_io(f.f_code):
+            return (_IDLE,)
+        frames = []
+        while f is not None:
+            frames.append(f)
+            f = f.f_back
+        frames.reverse()
+        for i in range(len(frames)-1, -1, -1):
+            if _trio_runner(frames[i].f_code):
+                break
+        else:
+            i = None
+
+        res = []
+        if i is not None:
+            rest = frames[i+1:]
+            if not rest or "trio" in rest[0].f_code.co_filename:
+                # the runner itself, i.e. waiting for something to happen
+                return (_IDLE,)
+            res.append(("~", 0, "task:%s" % (getattr(task, "name", "?"),)))
+            frames = rest
+        for f in frames:
+            c = f.f_code
+            res.append((c.co_filename, c.co_firstlineno, c.co_name))
+        return tuple(res)
+
+    def _snapshot(self):
+        with self._lock:
+            return dict(self.samples)
+
+    def top(self, n=10):
+        """
+        The @n functions with the most samples of their own.
+        Returns a list of (own samples, total samples, function).
+        """
+        own = Counter()
+        total = Counter()
+        for st,k in self._snapshot().items():
+            own[st[-1]] += k
+            for fn in set(st):
+                total[fn] += k
+        return [(k, total[fn], fn) for fn,k in own.most_common(n)]
+
+    def collapsed(self):
+        """
+        Iterate the samples as collapsed stacks.
+        """
+        for st,k in sorted(self._snapshot().items(), key=lambda x: -x[1]):
+            yield "%s %d" % (";".join(_fmt(fn) for fn in st), k)
+
+    def pstats(self):
+        """
+        The samples as a dict that `pstats.Stats` can read.
+        Times are estimated as samples times the sampling interval.
+        """
+        dt = self.interval
+        res = {}  # fn > [cc, nc, tt, ct, callers]
+        for st,k in self._snapshot().items():
+            seen = set()
+            for i,fn in enumerate(st):
+                try:
+                    r = res[fn]
+                except KeyError:
+                    r = res[fn] = [0, 0, 0.0, 0.0, {}]
+                if i == len(st)-1:
+                    r[2] += k*dt
+                if fn in seen:
+                    continue
+                seen.add(fn)
+                r[0] += k
+                r[1] += k
+                r[3] += k*dt
+                if i:
+                    c = st[i-1]
+                    cc, nc, tt, ct = r[4].get(c, (0, 0, 0.0, 0.0))
+                    r[4][c] = (cc+k, nc+k, tt + (k*dt if i == len(st)-1 else 0), ct+k*dt)
+        return {fn: tuple(r) for fn,r in res.items()}
+
+    def dump(self, path):
+        """
+        Write the samples to @path: a pstats file if the name ends with
+        ".prof" or ".pstats", collapsed stacks otherwise.
+        Returns the number of samples.
+        """
+        if path.endswith((".prof", ".pstats")):
+            with open(path+".tmp", "wb") as f:
+                marshal.dump(self.pstats(), f)
+        else:
+            with open(path+".tmp", "w") as f:
+                for line in self.collapsed():
+                    f.write(line+"\n")
+        os.rename(path+".tmp", path)
+        return self.n_samples
+
+
+def _fmt(fn):
+    file,line,name = fn
+    if file == "~":
+        return name
+    return "%s (%s:%d)" % (name, os.path.basename(file), line)
@@ -1,21 +1,16 @@
-from quart_trio import QuartTrio as Quart
-from quart.logging import create_serving_logger
-from quart import jsonify, websocket, Response, request
-from quart.exceptions import NotFound
-from quart.static import send_from_directory
-
-from hypercorn.config import Config as HyperConfig
-from hypercorn.trio import serve as hyper_serve
+# Quart, Hypercorn and YAML are imported when they're needed:
+# FIFO-only and offline use doesn't require them.
 
 import outcome
 from contextlib import asynccontextmanager
 from functools import partial
 from inspect import iscoroutine
 import shlex
-import yaml
+import hashlib
 
 from .util import attrdict, combine_dict, OSLineReader, ValueEvent
 from .alias import Alias
+from .trace import Tracer
 import trio
 import os
 import sys
@@ -110,6 +105,23 @@ class _CallMudlet:
             raise RuntimeError("Only for non-method calls")
         await self.server.rpc(action="delete", name=self.name)
 
+
+class _MudletFn:
+    """
+    A Lua function, looked up once by `Server.lua_fn`.
+    """
+    def __init__(self, server, fn, name):
+        self.server = server
+        self.fn = fn
+        self.name = name
+
+    def __repr__(self):
+        return "<%s %d:%s>" % (self.__class__.__name__, self.fn, ".".join(self.name))
+
+    async def __call__(self, *args, noreply=None):
+        return await self.server.rpc(action="callfn", fn=self.fn, args=args, noreply=noreply)
+
+
 class Server:
     """
     One instance corresponds to a specific Mudlet profile.
@@ -122,6 +134,7 @@ class Server:
 
         d = cfg.get('configdir', None)
         if d is not None:
+            import yaml
             cf = os.path.join(d,name+".cfg")
             with open(cf,"r") as f:
                 cfg = combine_dict(yaml.safe_load(f), cfg, cls=attrdict)
@@ -154,6 +167,7 @@ class Server:
         self._to_send_wait = trio.Event()
         self._replies = {}
         self._is_connected = trio.Event()
+        self.tracer = Tracer()
 
     @property
     async def is_running(self):
@@ -427,12 +441,17 @@ class Server:
         kw['seq'] = seq = self._seq
         self._seq += 1
         self._replies[seq] = ev = trio.Event()
+        t = self.tracer.now()
         self._send(kw)
         try:
             await ev.wait()
             return self._replies[seq].unwrap()
         finally:
             del self._replies[seq]
+            n = kw.get("name", kw.get("fn", ""))
+            if isinstance(n, list):
+                n = ".".join(str(x) for x in n)
+            self.tracer.add("%s %s" % (kw.get("action","?"), n), "rpc", t, lane="mudlet", overlap=True)
 
     async def event(self, name, *args):
         await self.rpc(action="event", name=name, args=args)
@@ -440,6 +459,39 @@ class Server:
     async def lua_eval(self, msg, name="unknown"):
         await self.rpc(action="eval",  code=msg, name=name)
 
+    async def lua_load(self, chunks):
+        """
+        Run Lua chunks unless Mudlet already did.
+
+        @chunks is a list of (name, code) pairs. Mudlet remembers each
+        chunk's hash, so after a reconnect only new or changed chunks are
+        sent. Returns the number of chunks that ran.
+        """
+        known = await self.rpc(action="chunks")
+        known = known[0] if known else None
+        if not isinstance(known, dict):
+            known = {}  # empty Lua tables are sent as lists
+        n = 0
+        for name,code in chunks:
+            h = hashlib.sha1(code.encode("utf-8")).hexdigest()
+            if known.get(name) == h:
+                continue
+            await self.rpc(action="load", name=name, hash=h, code=code)
+            n += 1
+        return n
+
+    async def lua_fn(self, name, meth=False):
+        """
+        Returns a handle to a Lua function (dotted name or list), which
+        can be called without Mudlet looking up its name every time.
+
+        Handles are valid until the link to Mudlet is re-established.
+        """
+        if isinstance(name, str):
+            name = name.split(".")
+        res = await self.rpc(action="mkfn", name=name, meth=meth)
+        return _MudletFn(self, res[0], name)
+
     @property
     def mud(self):
         return _CallMudlet(self, meth=False)
@@ -490,12 +542,18 @@ class Server:
             else:
                 cmd = cmd[1:]
         try:
-            await ali(cmd)
+            await self.run_alias(ocmd[:len(ocmd)-len(cmd)], ali, cmd)
         except Exception as err:
             self.__logger.warning("Error in alias %r", ocmd, exc_info=err)
             await self.mud.print(_("Error: {err!r}").format(err=err))
             await self.post_error()
 
+    async def run_alias(self, name, ali, cmd):
+        """
+        Run alias @name. Override this to instrument aliases.
+        """
+        await ali(cmd)
+
     async def post_error(self):
         pass
 
@@ -546,6 +604,9 @@ class Server:
 class WebServer:
 
     def __init__(self, cfg, factory=Server):
+        from quart_trio import QuartTrio as Quart
+        from quart import Response, request
+
         self.app = Quart(cfg['name'],
                 # no, we do not want any of those default folders and whatnot
                 static_folder=None,template_folder=None,root_path="/nonexistent",
@@ -599,6 +660,8 @@ class WebServer:
 
     @property
     async def server(self):
+        from quart import request
+
         sn = request.headers["Mudlet-Instance"]
         try:
             return self._server[sn]
@@ -619,13 +682,17 @@ class WebServer:
             del self._server[s.name]
 
 
-    async def run(self, * task_status=trio.TASK_STATUS_IGNORED) -> None:
+    async def run(self, *, task_status=trio.TASK_STATUS_IGNORED) -> None:
         """
         Run this application.
 
         This is a simple Hypercorn runner.
         You should probably use something more elaborate in a production setting.
         """
+        from quart.logging import create_serving_logger
+        from hypercorn.config import Config as HyperConfig
+        from hypercorn.trio import serve as hyper_serve
+
         config = HyperConfig()
         cfg = self.cfg['server']
         config.access_log_format = "%(h)s %(r)s %(s)s %(b)s %(D)s"
@@ -0,0 +1,120 @@
+# Timing traces
+#
+# Spans (process setup to finish, command to prompt, room changes, Mudlet
+# RPCs, SQL statements) are recorded into a ring buffer and can be dumped
+# in Chrome's trace event format, which chrome://tracing and
+# https://ui.perfetto.dev can display.
+#
+# Spans are recorded when they end, so there is no bookkeeping for spans
+# that never finish, and an overflowing ring only loses whole spans.
+
+import os
+import time
+import json
+from itertools import count
+from collections import deque
+from contextlib import contextmanager
+
+
+class Tracer:
+    """
+    A ring buffer of trace events.
+
+    An async span's begin and end events share a slot in the ring.
+
+    Each span is shown on a "lane" (a thread, in Chrome's terms). Spans on
+    the same lane must nest; spans which may overlap (like concurrent
+    RPCs) are recorded as async events instead.
+    """
+    def __init__(self, size=20000):
+        self.size = size
+        self.enabled = True
+        self.events = deque(maxlen=size)
+        self._lanes = {}
+        self._ids = count(1)
+        self._t0 = time.perf_counter()
+
+    def now(self):
+        """
+        The current timestamp, in microseconds.
+        """
+        return (time.perf_counter()-self._t0)*1000000
+
+    def _lane(self, lane):
+        try:
+            return self._lanes[lane]
+        except KeyError:
+            res = self._lanes[lane] = len(self._lanes)+1
+            return res
+
+    def add(self, name, cat, start, end=None, lane="main", overlap=False, **args):
+        """
+        Record a span from @start to @end (default: now).
+        """
+        if not self.enabled:
+            return
+        if end is None:
+            end = self.now()
+        tid = self._lane(lane)
+        ev = dict(name=name, cat=cat, pid=1, tid=tid)
+        if args:
+            ev["args"] = args
+        if overlap:
+            # one ring entry, so that the begin and end events are
+            # evicted together
+            i = next(self._ids)
+            self.events.append((dict(ev, ph="b", ts=start, id=i),
+                dict(ph="e", ts=end, id=i, name=name, cat=cat, pid=1, tid=tid)))
+        else:
+            self.events.append(dict(ev, ph="X", ts=start, dur=end-start))
+
+    def instant(self, name, cat, lane="main", **args):
+        """
+        Record a point in time.
+        """
+        if not self.enabled:
+            return
+        ev = dict(name=name, cat=cat, ph="i", s="t", ts=self.now(), pid=1, tid=self._lane(lane))
+        if args:
+            ev["args"] = args
+        self.events.append(ev)
+
+    @contextmanager
+    def span(self, name, cat, lane="main", overlap=False, **args):
+        """
+        Record the time spent in the ``with`` block.
+        """
+        t = self.now()
+        try:
+            yield
+        finally:
+            self.add(name, cat, t, lane=lane, overlap=overlap, **args)
+
+    def clear(self):
+        self.events.clear()
+
+    def trace(self):
+        """
+        The trace as a Chrome-compatible object.
+        """
+        ev = [dict(name="thread_name", ph="M", pid=1, tid=tid, args=dict(name=lane))
+                for lane,tid in self._lanes.items()]
+        ev.append(dict(name="process_name", ph="M", pid=1, args=dict(name="mudpyc")))
+        for e in self.events:
+            if isinstance(e, tuple):
+                ev.extend(e)
+            else:
+                ev.append(e)
+        return {"traceEvents": ev, "displayTimeUnit": "ms"}
+
+    def dump(self, path, trace=None):
+        """
+        Write the trace (default: the current one) to @path.
+        Returns the number of events.
+        """
+        if trace is None:
+            trace = self.trace()
+        with open(path+".tmp", "w") as f:
+            json.dump(trace, f, default=repr)
+        os.rename(path+".tmp", path)
+        return len(trace["traceEvents"])
@@ -0,0 +1,340 @@
+# Line triggers
+#
+# Incoming lines used to be tested against a sequence of checks, each with
+# its own startswith() or regex call. Here, drivers and users register
+# their patterns; they're compiled into a single regex (one alternative per
+# trigger, in priority order) so that classifying a line costs one scan.
+#
+# Additionally, if all patterns start with some literal text, lines that
+# don't start with any of them are rejected by a str.startswith() call
+# without touching the regex engine at all.
+#
+# `TextWatcher` is the receiving end of `S.text_watch`. Watchers which
+# only want some lines register their patterns with the server's watcher
+# engine, so they don't see (or buffer) anything else.
+
+import re
+from itertools import count
+from collections import deque
+
+import trio
+
+import logging
+logger = logging.getLogger(__name__)
+
+_meta = set(".^$*+?{}[]\\|()")
+_quant = set("*+?{")
+# things that can't be embedded in a larger pattern
+_unsafe = re.compile(r"\\[1-9]|\(\?P=|\(\?[aiLmsux]+\)")
+# group names might collide, and the combined regex doesn't need them
+_named = re.compile(r"\(\?P<\w+>")
+
+
+def literal_prefix(pattern):
+    """
+    Returns the literal text a regex must start with, possibly empty.
+    """
+    if "|" in pattern:
+        return ""  # might be a top-level alternative
+    res = []
+    i = 0
+    if pattern.startswith("^"):
+        i = 1
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            n = pattern[i+1:i+2]
+            if not n or n.isalnum():
+                break
+            c = n
+            i += 2
+        elif c in _meta:
+            break
+        else:
+            i += 1
+        if pattern[i:i+1] in _quant:
+            break  # the last character is optional or repeated
+        res.append(c)
+    return "".join(res)
+
+
+class Trigger:
+    """
+    A registered pattern. @name says what kind of line this is; @data is
+    for the registrant's use.
+    """
+    _seq = count()
+
+    def __init__(self, engine, name, pattern, regex, data, prio):
+        self.engine = engine
+        self.name = name
+        self.pattern = pattern
+        self.regex = regex
+        self.data = data
+        self.prio = prio
+        self.seq = next(self._seq)
+        self.group = "_t%d" % self.seq
+
+        if regex:
+            if isinstance(pattern, str):
+                pattern = re.compile(pattern)
+            self._re = pattern
+            p = pattern.pattern
+            if pattern.flags & (re.I | re.X):
+                self.prefix = ""  # the text isn't matched literally
+            else:
+                self.prefix = literal_prefix(p)
+            self.combinable = not (pattern.flags & ~re.UNICODE) and not _unsafe.search(p)
+            self.source = _named.sub("(", p)
+        else:
+            self._re = None
+            self.prefix = pattern
+            self.combinable = True
+            self.source = re.escape(pattern)
+
+    def __repr__(self):
+        return "<Trigger %s %r>" % (self.name, self.pattern)
+
+    @property
+    def key(self):
+        return (-self.prio, self.seq)
+
+    def match(self, line):
+        """
+        Returns a match object for regexes, the prefix's length for
+        prefixes, or None.
+        """
+        if self._re is not None:
+            return self._re.match(line)
+        if line.startswith(self.prefix):
+            return len(self.prefix)
+        return None
+
+    def remove(self):
+        self.engine.remove(self)
+
+
+class TriggerEngine:
+    """
+    A set of triggers which are matched against a line in one pass.
+
+    Triggers are either literal prefixes or regexes, which are anchored at
+    the start of the line like `re.match`. Use ".*" to find text anywhere.
+
+    Triggers with higher priority are tested first; within the same
+    priority, registration order applies.
+    """
+    def __init__(self):
+        self._triggers = []
+        self._clear()
+
+    def _clear(self):
+        self._fast = None
+        self._slow = None
+        self._index = None
+        self._prefilter = None
+        self._combined = {}
+
+    def add_prefix(self, prefix, name, data=None, prio=0):
+        """
+        Register a literal prefix.
+
+        The match object is the prefix's length.
+        """
+        if not prefix:
+            raise ValueError("empty prefix")
+        return self._add(Trigger(self, name, prefix, False, data, prio))
+
+    def add_regex(self, regex, name, data=None, prio=0):
+        """
+        Register a regex (either a string or compiled).
+        """
+        return self._add(Trigger(self, name, regex, True, data, prio))
+
+    def _add(self, trigger):
+        self._triggers.append(trigger)
+        self._triggers.sort(key=lambda t: t.key)
+        self._clear()
+        return trigger
+
+    def remove(self, trigger):
+        try:
+            self._triggers.remove(trigger)
+        except ValueError:
+            pass
+        else:
+            self._clear()
+
+    def __len__(self):
+        return len(self._triggers)
+
+    def __iter__(self):
+        return iter(self._triggers)
+
+    def _compile(self):
+        self._fast = [t for t in self._triggers if t.combinable]
+        self._slow = [t for t in self._triggers if not t.combinable]
+        self._index = {t.group:j for j,t in enumerate(self._fast)}
+        if self._slow:
+            logger.debug("Triggers not combinable: %r", self._slow)
+
+        pf = set()
+        for t in self._triggers:
+            if not t.prefix:
+                pf = None
+                break
+            pf.add(t.prefix)
+        self._prefilter = tuple(sorted(pf)) if pf is not None else None
+
+    def _combined_from(self, i):
+        """
+        The combined regex for the fast triggers, starting at index @i.
+        """
+        try:
+            return self._combined[i]
+        except KeyError:
+            pass
+        ts = self._fast[i:]
+        if ts:
+            r = re.compile("|".join("(?P<%s>%s)" % (t.group, t.source) for t in ts))
+        else:
+            r = None
+        self._combined[i] = r
+        return r
+
+    def _check(self, line):
+        if self._fast is None:
+            self._compile()
+        if self._prefilter is not None and not line.startswith(self._prefilter):
+            return False
+        return True
+
+    def _fast_match(self, line, i=0):
+        r = self._combined_from(i)
+        if r is None:
+            return None
+        m = r.match(line)
+        if m is None:
+            return None
+        # the trigger's own group closes last, so it's always `lastgroup`
+        return self._index[m.lastgroup]
+
+    def classify(self, line):
+        """
+        Find the first trigger matching this line.
+
+        Returns a (trigger, match) tuple, or (None, None).
+        """
+        if not self._check(line):
+            return None, None
+        j = self._fast_match(line)
+        if j is not None:
+            t = self._fast[j]
+        for s in self._slow:
+            if j is not None and t.key < s.key:
+                break
+            m = s.match(line)
+            if m is not None:
+                return s, m
+        if j is None:
+            return None, None
+        return t, t.match(line)
+
+    def matches(self, line):
+        """
+        Returns a list of all (trigger, match) tuples for this line, in
+        priority order.
+        """
+        if not self._check(line):
+            return []
+        res = []
+        i = 0
+        while True:
+            j = self._fast_match(line, i)
+            if j is None:
+                break
+            t = self._fast[j]
+            res.append((t, t.match(line)))
+            i = j+1
+        for s in self._slow:
+            m = s.match(line)
+            if m is not None:
+                res.append((s, m))
+        if self._slow:
+            res.sort(key=lambda tm: tm[0].key)
+        return res
+
+
+DROP_OLD = "drop_old"
+DROP_NEW = "drop_new"
+CLOSE = "close"
+
+
+class TextWatcher:
+    """
+    A buffered stream of lines, as returned by `S.text_watch`.
+
+    Iterating it yields lines; `None` marks a prompt. When the buffer is
+    full, @overflow says what to do: drop the oldest line, drop the new
+    line, or close the watcher (which ends the iteration after the
+    buffered lines have been read).
+    """
+    def __init__(self, size=100, overflow=CLOSE, name=None):
+        if overflow not in (DROP_OLD, DROP_NEW, CLOSE):
+            raise ValueError("overflow", overflow)
+        self.size = size
+        self.overflow = overflow
+        self.name = name
+        self.seen = 0
+        self.dropped = 0
+        self.closed = False
+        self.triggers = []  # in the server's watcher engine
+        self._q = deque()
+        self._evt = trio.Event()
+
+    def __repr__(self):
+        return "<TextWatcher %s: %d seen, %d dropped%s>" % (self.name or id(self),
+                self.seen, self.dropped, " closed" if self.closed else "")
+
+    def send(self, msg):
+        """
+        Queue a line. Does not block.
+
+        Returns False if the watcher is closed.
+        """
+        if self.closed:
+            return False
+        if len(self._q) >= self.size:
+            self.dropped += 1
+            if self.overflow == DROP_NEW:
+                return True
+            if self.overflow == DROP_OLD:
+                self._q.popleft()
+            else:
+                self.close()
+                return False
+        self._q.append(msg)
+        self.seen += 1
+        self._evt.set()
+        return True
+
+    def close(self):
+        self.closed = True
+        self._evt.set()
+
+    async def receive(self):
+        while not self._q:
+            if self.closed:
+                raise trio.EndOfChannel
+            self._evt = trio.Event()
+            await self._evt.wait()
+        return self._q.popleft()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.receive()
+        except trio.EndOfChannel:
+            raise StopAsyncIteration
@@ -96,6 +96,29 @@ def AD(x):
     return combine_dict(x, cls=attrdict, force=True)
 
 
+class Decho(str):
+    """
+    Text in the format of Mudlet's `decho`, i.e. with "<r,g,b:r,g,b>"
+    color tags.
+    """
+    @classmethod
+    def from_runs(cls, text, runs):
+        """
+        Color @text. @runs is a list of (start, "r,g,b:r,g,b") pairs,
+        in order; a run ends where the next one starts.
+        """
+        if not runs:
+            return cls(text)
+        res = []
+        if runs[0][0] > 0:
+            res.append(text[:runs[0][0]])
+        for i,(start,color) in enumerate(runs):
+            end = runs[i+1][0] if i+1 < len(runs) else len(text)
+            if start < end:
+                res.append("<%s>%s" % (color, text[start:end]))
+        return cls("".join(res))
+
+
 class OSLineReader:
     def __init__(self, fd, max_line_length=16384):
         self.fd = fd
@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+
+# Write the Mudlet map files in tests/fixtures/.
+#
+# They're written in the order of Mudlet's TMap::serialize / TRoom
+# serialization. Run this from the top of the source tree if you change
+# it; the tests read the files, not this script.
+
+import os
+import zlib
+import struct
+
+HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class Writer:
+    """
+    A minimal QDataStream writer.
+    """
+    def __init__(self):
+        self.buf = bytearray()
+
+    def int(self, v):
+        self.buf += struct.pack(">i", v)
+
+    def uint(self, v):
+        self.buf += struct.pack(">I", v)
+
+    def double(self, v):
+        self.buf += struct.pack(">d", v)
+
+    def bool(self, v):
+        self.buf += b"\1" if v else b"\0"
+
+    def byte(self, v):
+        self.buf += bytes((v,))
+
+    def string(self, v):
+        if v is None:
+            self.uint(0xFFFFFFFF)
+            return
+        b = v.encode("utf-16-be")
+        self.uint(len(b))
+        self.buf += b
+
+    def color(self, c):
+        if c is None:
+            self.buf += struct.pack(">bHHHHH", 0, 0, 0, 0, 0, 0)
+            return
+        r,g,b,a = c
+        self.buf += struct.pack(">bHHHHH", 1, a*257, r*257, g*257, b*257, 0)
+
+    def vector3d(self, v):
+        for x in v:
+            self.double(x)
+
+    def pointf(self, v):
+        for x in v:
+            self.double(x)
+
+    def list(self, item, v):
+        self.uint(len(v))
+        for x in v:
+            item(x)
+
+    def map(self, key, value, v):
+        # Qt writes maps back to front
+        items = list(v.items()) if isinstance(v, dict) else list(v)
+        self.uint(len(items))
+        for k,x in reversed(items):
+            key(k)
+            value(x)
+
+    def pixmap(self, png):
+        self.int(1 if png else 0)
+        if png:
+            self.buf += png
+
+
+def _png():
+    # a 1x1 grey image
+    def chunk(typ, data):
+        return struct.pack(">I", len(data)) + typ + data + struct.pack(">I", zlib.crc32(typ+data))
+    return (b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(b"\0\x80"))
+        + chunk(b"IEND", b""))
+
+
+AREAS = {1: "Town", 2: "Forest"}
+
+# GMCP room hashes
+H1,H2,H4 = ("%032x" % (0xabcdef00+i) for i in (1,2,4))
+
+# id, area, (x,y,z), {dir:dst}, name, {cmd:dst}, stubs, hash, symbol, user_data
+ROOMS = [
+    (1, 1, (0,0,0), {"east":2, "up":4}, "Market square.", {"1enter shop":3}, [], H1, "M", {"note":"start"}),
+    (2, 1, (1,0,0), {"west":1}, "Main street.", {}, [1,4], H2, "", {}),  # stubs: Mudlet's codes
+    (3, 1, (0,1,0), {}, "A shop.", {"0leave":1}, [], None, None, {}),
+    (4, 2, (0,0,1), {"down":1}, "Tree top.", {}, [], H4, "", {}),
+]
+
+LABELS = {
+    1: [(1, (2.0, 3.0, 0.0), (4.0, 1.0), "Town", (255,255,0,255), None, True)],
+    2: [(7, (0.0, -2.0, 1.0), (3.0, 1.0), "Forest", (0,255,0,255), (0,0,0,128), False),
+        (8, (1.0, 1.0, 1.0), (1.0, 1.0), "", None, None, False)],
+}
+
+EXIT_DIRS = ("north","northeast","east","southeast","south","southwest",
+        "west","northwest","up","down","in","out")
+
+
+def write_map(version):
+    w = Writer()
+    w.int(version)
+    w.map(w.int, w.int, {1:4, 2:2})  # env colors
+    w.map(w.int, w.string, AREAS)
+    w.map(w.int, w.color, {300: (10,20,30,255)})  # custom env colors
+    w.map(w.string, w.int, {r[7]:r[0] for r in ROOMS if r[7]})
+    w.map(w.string, w.string, {"mud": "test"})  # user data
+    if version >= 19:
+        w.string("Bitstream Vera Sans Mono")
+        w.double(1.0)
+        w.bool(False)
+
+    w.int(len(AREAS))
+    for aid in AREAS:
+        rooms = [r[0] for r in ROOMS if r[1] == aid]
+        w.int(aid)
+        w.list(w.int, rooms)
+        w.list(w.int, sorted({r[2][2] for r in ROOMS if r[1] == aid}))
+        w.map(w.int, lambda p: (w.int(p[0]), w.int(p[1])), [])  # area exits
+        w.bool(False)  # grid mode
+        for _ in range(6):
+            w.int(0)
+        w.vector3d((0,0,0))  # span
+        for _ in range(4):
+            w.map(w.int, w.int, {0:0})
+        w.vector3d((0,0,0))  # pos
+        w.bool(False)  # zone
+        w.int(0)  # zone ref
+        w.map(w.string, w.string, {"area": AREAS[aid]})
+
+    if version >= 18:
+        w.map(w.string, w.int, {"default": 1})
+    else:
+        w.int(1)
+
+    # labels: number of areas with labels; per area, count then area ID
+    w.int(len(LABELS))
+    for aid,labels in LABELS.items():
+        w.int(len(labels))
+        w.int(aid)
+        for lid,pos,size,text,fg,bg,png in labels:
+            w.int(lid)
+            w.vector3d(pos)
+            w.pointf((0,0))
+            w.pointf(size)
+            w.string(text)
+            w.color(fg)
+            w.color(bg)
+            w.pixmap(_png() if png else None)
+            w.bool(False)  # no scaling
+            w.bool(True)  # show on top
+
+    for rid,area,(x,y,z),exits,name,special,stubs,h,symbol,ud in ROOMS:
+        w.int(rid)
+        w.int(area)
+        w.int(x)
+        w.int(y)
+        w.int(z)
+        for d in EXIT_DIRS:
+            w.int(exits.get(d, -1))
+        w.int(1)  # env
+        w.int(1)  # weight
+        w.string(name)
+        w.bool(False)  # locked
+        w.map(w.int, w.string, [(dst,cmd) for cmd,dst in special.items()])
+        if version >= 19:
+            w.string(symbol)
+        else:
+            w.byte(ord(symbol) if symbol else 0)
+        w.map(w.string, w.string, ud)
+        w.map(w.string, lambda v: w.list(w.pointf, v), {"east": [(0.5,0.0), (1.0,0.0)]} if rid == 1 else {})
+        w.map(w.string, w.bool, {"east": True} if rid == 1 else {})
+        if version >= 20:
+            w.map(w.string, w.color, {"east": (255,0,0,255)} if rid == 1 else {})
+            w.map(w.string, w.int, {"east": 1} if rid == 1 else {})
+        else:
+            w.map(w.string, lambda v: w.list(w.int, v), {"east": [255,0,0]} if rid == 1 else {})
+            w.map(w.string, w.string, {"east": "solid line"} if rid == 1 else {})
+        w.list(w.int, [])  # exit locks
+        w.list(w.int, stubs)
+        w.map(w.string, w.int, {"east": 2} if rid == 1 else {})  # exit weights
+        w.map(w.string, w.int, {})  # doors
+    return bytes(w.buf)
+
+
+def main():
+    os.makedirs(HERE, exist_ok=True)
+    for v in (18, 20):
+        with open(os.path.join(HERE, f"map-v{v}.dat"), "wb") as f:
+            f.write(write_map(v))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+# Write tests/fixtures/map-v20-qt.dat with Qt's own QDataStream.
+#
+# make_map_fixtures.py encodes the Qt types by hand, the same way the
+# reader decodes them, so a misunderstanding would go unnoticed. This
+# script lets PyQt5 do the encoding (QString, QColor, QVector3D, QImage
+# as PNG, ...) and stores the values in the order and with the types of
+# Mudlet's TMap::serialize, TArea and TRoom (map version 20, as saved by
+# Mudlet 4.x): areas include Mudlet's "Default Area", exit stubs and
+# locks use Mudlet's direction codes, custom lines and exit weights are
+# keyed by short direction names.
+#
+# Needs PyQt5. Run from the top of the source tree if you change it;
+# the tests read the file, not this script.
+
+import os
+
+from PyQt5.QtCore import QByteArray, QDataStream, QIODevice, QPointF, QSizeF, Qt
+from PyQt5.QtGui import QColor, QVector3D, QImage
+
+HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Mudlet's direction codes (DIR_NORTH …), used for stubs and locks
+DIR = dict(north=1, northeast=2, northwest=3, east=4, west=5, south=6,
+        southeast=7, southwest=8, up=9, down=10, **{"in": 11, "out": 12})
+
+# the order of TRoom's exit fields
+EXIT_DIRS = ("north","northeast","east","southeast","south","southwest",
+        "west","northwest","up","down","in","out")
+
+AREAS = {-1: "Default Area", 1: "Town", 2: "Forest"}
+
+H1,H2,H4 = ("%032x" % (0xabcdef00+i) for i in (1,2,4))
+
+ROOMS = [
+    dict(id=1, area=1, pos=(0,0,0), exits={"east":2, "up":4},
+        name="Market square.", special=[(3, "1enter shop")], symbol="M",
+        user_data={"note": "start"}, locks=[DIR["up"]],
+        lines={"e": [QPointF(0.5, 0.0), QPointF(1.0, 0.0)]},
+        weights={"e": 2}, doors={"e": 1}),
+    dict(id=2, area=1, pos=(1,0,0), exits={"west":1}, name="Main street.",
+        stubs=[DIR["north"], DIR["east"]]),
+    dict(id=3, area=1, pos=(0,1,0), name="A shop.", special=[(1, "0leave")]),
+    dict(id=4, area=2, pos=(0,0,1), exits={"down":1}, name="Tree top – Baumkrone."),
+    dict(id=5, area=-1, pos=(5,5,0), name=""),
+]
+HASHES = {H1: 1, H2: 2, H4: 4}
+
+
+class Stream:
+    def __init__(self):
+        self.ba = QByteArray()
+        self.ds = QDataStream(self.ba, QIODevice.WriteOnly)
+        self.ds.setVersion(QDataStream.Qt_5_12)
+
+    def __lshift__(self, v):
+        if isinstance(v, bool):
+            self.ds.writeBool(v)
+        elif isinstance(v, int):
+            self.ds.writeInt32(v)
+        elif isinstance(v, float):
+            self.ds.writeDouble(v)
+        elif v is None or isinstance(v, str):
+            self.ds.writeQString(v)
+        else:
+            self.ds << v
+        return self
+
+    def list(self, v):
+        # QList, QSet
+        self.ds.writeUInt32(len(v))
+        for x in v:
+            self << x
+
+    def map(self, v):
+        # QMap (and QMultiMap): sorted by key, written back to front
+        items = sorted(v.items() if isinstance(v, dict) else v, key=lambda kv: kv[0])
+        self.ds.writeUInt32(len(items))
+        for k,x in reversed(items):
+            self << k
+            if isinstance(x, tuple):  # QPair
+                self << x[0] << x[1]
+            elif isinstance(x, list):
+                self.list(x)
+            else:
+                self << x
+
+    def hash(self, v):
+        # QHash: any order
+        self.ds.writeUInt32(len(v))
+        for k,x in v.items():
+            self << k << x
+
+
+def label_image():
+    img = QImage(4, 2, QImage.Format_ARGB32)
+    img.fill(QColor(255, 255, 0))
+    return img
+
+
+def write_map():
+    s = Stream()
+    s << 20
+    s.map({1: 4, 2: 2})  # mEnvColors
+    s.map(AREAS)
+    s.map({257: QColor(10, 20, 30)})  # mCustomEnvColors
+    s.map(HASHES)  # hashToRoomID
+    s.map({"mud": "test"})  # mUserData
+    s << "Bitstream Vera Sans Mono,10,-1,5,50,0,0,0,0,0" << 1.0 << False
+
+    s << len(AREAS)
+    for aid in sorted(AREAS):
+        rooms = [r for r in ROOMS if r["area"] == aid]
+        s << aid
+        s.list([r["id"] for r in rooms])  # QSet<int>
+        s.list(sorted({r["pos"][2] for r in rooms}))  # zLevels
+        s.map([(1, (4, DIR["up"]))] if aid == 1 else [])  # mAreaExits
+        s << False  # gridMode
+        for v in (1, 1, 0, 0, 0, 0):  # max_x/y/z, min_x/y/z
+            s << v
+        s << QVector3D(1, 1, 0)  # span
+        for _ in range(4):  # x/y max/min for z
+            s.map({0: 1})
+        s << QVector3D(0, 0, 0)  # pos
+        s << False << -1  # isZone, zoneAreaRef
+        s.map({"area": AREAS[aid]} if aid == 2 else {})  # mUserData
+
+    s.hash({"MyProfile": 1})  # mRoomIdHash
+
+    # labels, per area: number of labels, area ID, labels
+    labels = {
+        1: [(0, QVector3D(2, 3, 0), QSizeF(4, 1), "Town", QColor(255, 255, 0), QColor(0, 0, 0, 128), label_image())],
+        2: [(3, QVector3D(0, -2, 1), QSizeF(3, 1), "", QColor(), QColor(), QImage())],
+    }
+    s << len(labels)
+    for aid in sorted(labels):
+        s << len(labels[aid]) << aid
+        for lid,pos,size,text,fg,bg,img in labels[aid]:
+            s << lid << pos << QPointF() << size << text << fg << bg << img
+            s << False << True  # noScaling, showOnTop
+
+    for r in ROOMS:
+        s << r["id"] << r["area"]
+        for v in r["pos"]:
+            s << v
+        ex = r.get("exits", {})
+        for d in EXIT_DIRS:
+            s << ex.get(d, -1)
+        s << 1 << 1  # environment, weight
+        s << r["name"] << False  # name, isLocked
+        s.map(r.get("special", []))  # QMultiMap<int,QString>
+        s << r.get("symbol")
+        s.map(r.get("user_data", {}))
+        lines = r.get("lines", {})
+        s.map({k: v for k,v in lines.items()})  # customLines
+        s.map({k: True for k in lines})  # customLinesArrow
+        s.map({k: QColor(255, 0, 0) for k in lines})  # customLinesColor
+        s.map({k: int(Qt.DashLine) for k in lines})  # customLinesStyle
+        s.list(r.get("locks", []))  # exitLocks
+        s.list(r.get("stubs", []))  # exitStubs
+        s.map(r.get("weights", {}))
+        s.map(r.get("doors", {}))
+    return bytes(s.ba)
+
+
+def main():
+    os.makedirs(HERE, exist_ok=True)
+    with open(os.path.join(HERE, "map-v20-qt.dat"), "wb") as f:
+        f.write(write_map())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import os
+
+import trio
+
+from mudpyc.logfile import LogFile
+
+
+def test_rotate_bytes(tmp_path):
+    # non-ASCII text: the size limit counts bytes, not characters
+    path = str(tmp_path / "log")
+    log = LogFile(path, size=100, delay=0)
+    log._open()
+    log._write(["Hauptstraße ÄÖÜ\n"] * 4)
+    assert log.written == os.path.getsize(path) == 80
+    log._write(["ü\n"] * 10)
+    assert log.written == 0
+    log._close([])
+    old, = [fn for fn in os.listdir(str(tmp_path)) if fn != "log"]
+    assert os.path.getsize(str(tmp_path / old)) == 110
+
+
+def test_write_error(tmp_path):
+    # the writer survives an unwritable file and counts what it lost
+    path = str(tmp_path / "sub" / "log")
+
+    async def main():
+        log = LogFile(path, delay=0)
+        async with trio.open_nursery() as n:
+            await n.start(log.run)
+            log.write("lost")
+            await trio.sleep(0.2)
+            os.mkdir(str(tmp_path / "sub"))
+            log.write("kept")
+            await trio.sleep(0.2)
+            await log.aclose()
+
+    trio.run(main)
+    with open(path) as f:
+        assert f.read() == "kept\n*** 1 lines dropped ***\n"
@@ -0,0 +1,169 @@
+import os
+import shutil
+
+import pytest
+
+from mudpyc.mapper.mudlet_map import MudletMap, MapFormatError
+
+# see make_map_fixtures.py
+H1,H2,H4 = ("%032x" % (0xabcdef00+i) for i in (1,2,4))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fixture(name):
+    return os.path.join(FIXTURES, name)
+
+
+@pytest.mark.parametrize("version", [18, 20])
+def test_header(version):
+    with MudletMap(fixture(f"map-v{version}.dat")) as mm:
+        assert mm.version == version
+        assert mm.area_names == {1: "Town", 2: "Forest"}
+        assert set(mm.areas) == {1, 2}
+        assert sorted(mm.areas[1].rooms) == [1, 2, 3]
+        assert mm.areas[2].user_data == {"area": "Forest"}
+        assert mm.hashes == {1: H1, 2: H2, 4: H4}
+        assert mm.user_data == {"mud": "test"}
+        assert mm.player_room == {"default": 1}
+
+
+@pytest.mark.parametrize("version", [18, 20])
+def test_rooms(version):
+    with MudletMap(fixture(f"map-v{version}.dat")) as mm:
+        rooms = {r.id: r for r in mm.rooms()}
+    assert set(rooms) == {1, 2, 3, 4}
+    r = rooms[1]
+    assert (r.area, r.x, r.y, r.z) == (1, 0, 0, 0)
+    assert r.name == "Market square."
+    assert r.exits == {"east": 2, "up": 4}
+    assert r.special == {"enter shop": 3}  # lock flag removed
+    assert r.user_data == {"note": "start"}
+    assert r.weights == {"east": 2}
+    assert r.hash == H1
+    assert r.symbol == ("M" if version >= 19 else None)
+    assert rooms[2].stubs == ["north", "east"]
+    assert rooms[3].hash is None
+    assert rooms[3].special == {"leave": 1}
+
+
+def test_qt_encoding():
+    # written by Qt itself, see make_qt_map_fixture.py
+    with MudletMap(fixture("map-v20-qt.dat")) as mm:
+        assert mm.version == 20
+        assert mm.area_names == {-1: "Default Area", 1: "Town", 2: "Forest"}
+        assert mm.areas[2].user_data == {"area": "Forest"}
+        assert mm.hashes == {1: H1, 2: H2, 4: H4}
+        assert mm.player_room == {"MyProfile": 1}
+        rooms = {r.id: r for r in mm.rooms()}
+    assert set(rooms) == {1, 2, 3, 4, 5}
+    r = rooms[1]
+    assert r.exits == {"east": 2, "up": 4}
+    assert r.special == {"enter shop": 3}
+    assert r.symbol == "M"
+    assert r.weights == {"e": 2}
+    assert rooms[2].stubs == ["north", "east"]
+    assert rooms[2].symbol is None
+    assert rooms[4].name == "Tree top – Baumkrone."
+    assert (rooms[5].area, rooms[5].name) == (-1, "")
+
+
+def test_bad_version(tmp_path):
+    fn = tmp_path / "bad.dat"
+    fn.write_bytes(b"\0\0\0\x05")
+    with pytest.raises(MapFormatError):
+        MudletMap(str(fn)).open()
+
+
+def test_truncated(tmp_path):
+    with open(fixture("map-v20.dat"), "rb") as f:
+        data = f.read()
+    fn = tmp_path / "short.dat"
+
+    fn.write_bytes(data[:200])  # in the header
+    with pytest.raises(MapFormatError):
+        MudletMap(str(fn)).open()
+
+    fn.write_bytes(data[:-20])  # in the last room
+    with MudletMap(str(fn)) as mm:
+        with pytest.raises(MapFormatError):
+            list(mm.rooms())
+
+
+class FakeDriver:
+    @staticmethod
+    def intl2loc(d):
+        return d
+
+    @staticmethod
+    def clean_shortname(name):
+        return name.rstrip(".")
+
+
+@pytest.fixture
+def db(tmp_path):
+    pytest.importorskip("sqlalchemy")
+    from mudpyc.mapper.sql import SQL
+
+    with SQL(dict(sql=dict(url="sqlite:///"+str(tmp_path/"map.db")))) as db:
+        db.Room.metadata.create_all(db.db.bind)
+        yield db
+
+
+def _import(db, fn, **kw):
+    import trio
+    from mudpyc.mapper.mudlet_map import import_map
+
+    async def run():
+        with MudletMap(fn) as mm:
+            return await import_map(db, mm, FakeDriver(), **kw)
+    return trio.run(run)
+
+
+def test_import(db):
+    nr,nx = _import(db, fixture("map-v20.dat"))
+    assert nr == 4
+    assert nx == 8  # 4 exits, 2 special exits, 2 stubs
+
+    assert {a.id: a.name for a in db.q(db.Area)} == {1: "Town", 2: "Forest"}
+    r = db.r_mudlet(1)
+    assert r.name == "Market square"
+    assert r.id_gmcp == H1
+    assert (r.area_id, r.pos_x, r.pos_y, r.pos_z) == (1, 0, 0, 0)
+    ex = {x.dir: x.dst.id_mudlet if x.dst else None for x in r.exits}
+    assert ex == {"east": 2, "up": 4, "enter shop": 3}
+    ex = {x.dir: x.dst for x in db.r_mudlet(2).exits}
+    assert ex["north"] is None and ex["east"] is None
+
+    # importing again changes nothing
+    assert _import(db, fixture("map-v20.dat")) == (0, 0)
+
+
+def test_import_merge(db, tmp_path):
+    # a room that only has a GMCP hash is adopted, not duplicated
+    r = db.Room(name="Old market", id_gmcp=H1, pos_x=5, pos_y=5, pos_z=0)
+    db.add(r)
+    db.commit()
+    rid = r.id_old
+
+    fn = str(tmp_path/"map.dat")
+    shutil.copy(fixture("map-v18.dat"), fn)
+    nr,nx = _import(db, fn, explode=(2, 3))
+    assert nr == 3
+
+    r = db.r_old(rid)
+    assert r.id_mudlet == 1
+    assert r.name == "Old market"
+    assert (r.pos_x, r.pos_y) == (5, 5)  # known rooms keep their data
+    r = db.r_mudlet(3)
+    assert (r.pos_x, r.pos_y) == (0, 3)  # exploded
+
+
+def test_import_qt(db):
+    nr,nx = _import(db, fixture("map-v20-qt.dat"))
+    assert nr == 5
+    assert nx == 8  # 4 exits, 2 special exits, 2 stubs
+    assert {a.id for a in db.q(db.Area)} == {1, 2}  # not Mudlet's default area
+    assert db.r_mudlet(5).area_id is None
+    ex = {x.dir: x.dst for x in db.r_mudlet(2).exits}
+    assert ex["north"] is None and ex["east"] is None
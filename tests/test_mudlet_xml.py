@@ -0,0 +1,132 @@
+import os
+import re
+import glob
+import xml.dom.minidom
+
+import pytest
+
+from mudpyc.mapper.maphash import room_hash
+from mudpyc.util import Decho
+
+TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Mudlet ID, (x,y,z), area, env, name, {dir: dst}, {special exit: dst}
+ROOMS = [
+    (1, (0,0,0), 1, 4, "Market square", {"east":2, "up":4}, {"enter shop":3}),
+    (2, (-3,12,1), None, None, "Hauptstraße", {}, {}),
+    (3, (5,-1,0), 2, 272, "", {"west":17}, {}),
+]
+# computed once, so that both sides are checked against fixed values
+HASHES = [85952047, 2446112656, 256874142]
+
+
+def scripts():
+    """
+    The Lua scripts in mudpyc.xml, by name.
+    """
+    doc = xml.dom.minidom.parse(os.path.join(TOP, "mudpyc.xml"))
+    res = {}
+    for s in doc.getElementsByTagName("Script"):
+        name = s.getElementsByTagName("name")[0].firstChild.data
+        code = s.getElementsByTagName("script")[0].firstChild
+        res[name] = code.data if code is not None else ""
+    return res
+
+
+def test_py_functions_defined():
+    # Every Lua function the Python code calls must exist.
+    lua = "\n".join(scripts().values())
+    defined = set(re.findall(r"^function py\.(\w+)", lua, re.M))
+    used = set()
+    for fn in glob.glob(os.path.join(TOP, "mudpyc", "**", "*.py"), recursive=True):
+        with open(fn) as f:
+            src = f.read()
+        used.update(re.findall(r"\bmud\.py\.(\w+)", src))
+        used.update(re.findall(r"lua_fn\(\"py\.(\w+)\"", src))
+    assert used
+    assert used - defined == set()
+
+
+def test_room_hash():
+    for (_,(x,y,z),area,env,name,exits,special),h in zip(ROOMS, HASHES):
+        ex = list(exits.items()) + list(special.items())
+        assert room_hash(x,y,z, area, env, name, ex) == h
+
+
+def test_room_hash_lua():
+    lupa = pytest.importorskip("lupa")
+    try:
+        from lupa.lua51 import LuaRuntime  # what Mudlet uses
+    except ImportError:
+        LuaRuntime = lupa.LuaRuntime
+    lua = LuaRuntime()
+    lua.execute("py = {}")
+    lua.execute(scripts()["Map watcher"])
+
+    # just enough of Mudlet's mapper API
+    rooms = {r[0]: r for r in ROOMS}
+    def room(r):
+        _,(x,y,z),area,env,name,exits,special = rooms[r]
+        return lua.table(x, y, z, area, env, name,
+                lua.table_from(exits), lua.table_from(special))
+    g = lua.globals()
+    g._room = room
+    g._exists = lambda r: r in rooms
+    lua.execute("""
+        function roomExists(r) return _exists(r) end
+        function getRoomCoordinates(r) local d = _room(r) return d[1], d[2], d[3] end
+        function getRoomArea(r) return _room(r)[4] end
+        function getRoomEnv(r) return _room(r)[5] end
+        function getRoomName(r) return _room(r)[6] end
+        function getRoomExits(r) return _room(r)[7] end
+        function getSpecialExitsSwap(r) return _room(r)[8] end
+    """)
+
+    res = g.py.roomHashes(lua.table_from([1, 2, 3, 99]))
+    assert [res[i] for i in range(1, 5)] == HASHES + [0]
+
+
+def lua_function(name):
+    """
+    The source of a top-level Lua function in mudpyc.xml.
+    """
+    for code in scripts().values():
+        m = re.search(r"^function %s\(.*?^end$" % re.escape(name), code, re.M|re.S)
+        if m:
+            return m.group(0)
+    raise KeyError(name)
+
+
+def test_color_runs_lua():
+    lupa = pytest.importorskip("lupa")
+    lua = lupa.LuaRuntime()
+    lua.execute("py = {}")
+    lua.execute(lua_function("py.color_runs"))
+
+    # "ab" red on black, "c" green on black, "d" green on white
+    fg = [(255,0,0), (255,0,0), (0,255,0), (0,255,0)]
+    bg = [(0,0,0)]*3 + [(255,255,255)]
+    pos = [None]
+    g = lua.globals()
+    g.utf8 = lua.table(len=lambda s: len(s.decode("utf-8") if isinstance(s, bytes) else s))
+    def select(i, n):
+        pos[0] = i
+    g.selectSection = select
+    g.deselect = lambda: None
+    g._fg = lambda: lua.table(*fg[pos[0]])
+    g._bg = lambda: lua.table(*bg[pos[0]])
+    lua.execute("""
+        function getFgColor() local c = _fg() return c[1], c[2], c[3] end
+        function getBgColor() local c = _bg() return c[1], c[2], c[3] end
+    """)
+    runs = g.py.color_runs("abcd")
+    runs = [(r[1], r[2]) for r in (runs[i] for i in range(1, len(runs)+1))]
+    assert runs == [(0, "255,0,0:0,0,0"), (2, "0,255,0:0,0,0"), (3, "0,255,0:255,255,255")]
+    assert Decho.from_runs("abcd", runs) == "<255,0,0:0,0,0>ab<0,255,0:0,0,0>c<0,255,0:255,255,255>d"
+
+
+def test_decho():
+    runs = [(0, "1,1,1:0,0,0"), (3, "2,2,2:0,0,0"), (9, "3,3,3:0,0,0")]
+    assert Decho.from_runs("foobar", runs) == "<1,1,1:0,0,0>foo<2,2,2:0,0,0>bar"
+    assert Decho.from_runs("foo", [(1, "1,1,1:0,0,0")]) == "f<1,1,1:0,0,0>oo"
+    assert Decho.from_runs("foo", []) == "foo"
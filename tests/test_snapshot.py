@@ -0,0 +1,57 @@
+import pytest
+import trio
+
+np = pytest.importorskip("numpy")
+
+from mudpyc.mapper import snapshot
+
+DATA = dict(
+    room_id=[1, 2, 3], room_mudlet=[10, 0, 30], room_area=[1, 1, 1],
+    room_flag=[0, 0, 0], room_x=[0, 5, 10], room_y=[0, 0, 0], room_z=[0, 0, 0],
+    room_label=["home", "", ""],
+    exit_dst=[2, 3, 1], exit_cost=[1, 2, 3], exit_flag=[0, 0, 0],
+    room_exits=[0, 2, 2, 3],
+    area_id=[1], area_flag=[0], area_name=["Town"],
+)
+
+
+def test_roundtrip(tmp_path):
+    fn = str(tmp_path/"snap")
+    snapshot.write(fn, 42, DATA)
+    assert snapshot.load(fn, 41) is None  # stale
+
+    with snapshot.load(fn, 42) as snap:
+        assert snap.generation == 42
+        assert snap.room_id.tolist() == [1, 2, 3]
+        entries = list(snap.cache_entries())
+    # room 2 isn't in Mudlet, so the exit to it is dropped
+    assert entries == [(1, 10, "home", {3: 2}), (3, 30, None, {1: 3})]
+    assert snap._mm is None
+    assert not hasattr(snap, "room_id")
+
+
+def test_writer_retries(tmp_path, monkeypatch):
+    fn = str(tmp_path/"snap")
+    calls = []
+
+    def collect_write(db, path):
+        calls.append(path)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        snapshot.write(path, 7, DATA)
+        return 7
+
+    class DB:
+        async def wait_generation(self, gen):
+            await trio.sleep_forever()
+
+    monkeypatch.setattr(snapshot, "_collect_write", collect_write)
+
+    async def run():
+        with trio.move_on_after(0.3):
+            await snapshot.snapshot_writer(DB(), fn, retry=0.01)
+    trio.run(run)
+    assert len(calls) == 2
+    with snapshot.load(fn) as snap:
+        assert snap.generation == 7
+    assert snapshot._writers == {}
@@ -0,0 +1,58 @@
+from mudpyc.mapper.spatial import SpatialIndex
+
+
+def test_cells():
+    sp = SpatialIndex((5, 4))
+    sp.set(1, 1, 0,0,0)
+    sp.set(2, 1, 5,0,0)
+    sp.set(3, 1, 7,3,0)  # diagonal offset: same cell as room 2
+    sp.set(4, 2, 0,0,0)
+    assert sp.at(1, 0,0,0) == {1}
+    assert sp.at(1, 9,3,0) == {2,3}
+    assert sp.at(1, 0,4,0) == set()
+    assert sp.at(1, 0,0,1) == set()
+    assert sorted(sp.near(1, 0,0,0)) == [1,2,3]
+    assert sp.position(3) == (1, 7,3,0)
+
+
+def test_move():
+    sp = SpatialIndex(5)
+    sp.set(1, 1, 0,0,0)
+    sp.set(1, 1, 2,1,0)  # same cell
+    assert sp.position(1) == (1, 2,1,0)
+    sp.set(1, 1, 10,0,0)
+    assert sp.at(1, 0,0,0) == set()
+    assert sp.at(1, 10,0,0) == {1}
+    sp.remove(1)
+    assert len(sp) == 0
+    assert sp.position(1) is None
+
+
+def test_free_near():
+    sp = SpatialIndex((5, 5))
+    assert sp.free_near(1, 5,0,0) == (5,0)
+    sp.set(1, 1, 0,0,0)
+    sp.set(2, 1, 5,0,0)
+    pos = sp.free_near(1, 5,0,0)
+    assert pos not in ((0,0), (5,0))
+    assert pos[0] % 5 == 0 and pos[1] % 5 == 0  # one grid step away
+    assert abs(pos[0]-5) + abs(pos[1]) == 5
+    assert sp.free_near(1, 5,0,0, ignore=2) == (5,0)
+
+
+def test_isqrt_fallback(monkeypatch):
+    # Python 3.7 doesn't have math.isqrt
+    import math
+    import importlib
+    from mudpyc.mapper import spiral
+
+    isqrt = math.isqrt
+    monkeypatch.delattr(math, "isqrt")
+    try:
+        importlib.reload(spiral)
+        assert spiral._isqrt is not isqrt
+        for n in list(range(2000)) + [10**30+7, 2**200-1, 2**200]:
+            assert spiral._isqrt(n) == isqrt(n)
+    finally:
+        monkeypatch.undo()
+        importlib.reload(spiral)
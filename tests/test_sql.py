@@ -0,0 +1,33 @@
+import pytest
+
+
+@pytest.fixture
+def db(tmp_path):
+    pytest.importorskip("sqlalchemy")
+    from mudpyc.mapper.sql import SQL
+
+    with SQL(dict(sql=dict(url="sqlite:///"+str(tmp_path/"map.db")))) as db:
+        db.Room.metadata.create_all(db.db.bind)
+        yield db
+
+
+def test_texts(db):
+    r1,r2,r3 = (db.Room(name=f"Room {i}") for i in range(3))
+    db.add(r1); db.add(r2); db.add(r3)
+    db.commit()
+    db.add(db.LongDescr(room_id=r1.id_old, descr="A big hall."))
+    db.add(db.Note(room_id=r1.id_old, note="Dragon!"))
+    db.add(db.Note(room_id=r2.id_old, note="Dragon?"))
+    db.commit()
+    ids = (r1.id_old, r2.id_old, r3.id_old)
+    db.db.expunge_all()
+
+    rs = db.rooms(ids, "plain")
+    q = db.stats.queries
+    # the texts are deferred …
+    assert rs[0].long_descr and rs[0].note
+    assert "descr" not in rs[0].long_descr.__dict__
+    # … and read with one query
+    assert [tuple(r.texts()) for r in rs] == [
+            ("A big hall.", "Dragon!"), (None, "Dragon?"), (None, None)]
+    assert db.stats.queries == q + 2 + 3
@@ -0,0 +1,111 @@
+import trio
+
+from mudpyc.util import attrdict
+from mudpyc.mapper.main import S, WalkProcess
+
+
+class Room:
+    def __init__(self, n):
+        self.id_old = n
+        self.id_gmcp = "%032x" % n
+        self.idn_str = "#%d" % n
+        self.name = "Room %d" % n
+
+    def __repr__(self):
+        return "<Room %d>" % self.id_old
+
+
+class FakeServer:
+    def __init__(self, rooms, start):
+        self.conf = {"walk_pipeline": 5}
+        self.dr = attrdict(can_speedwalk=False)
+        self.rooms = {r.id_gmcp: r for r in rooms}
+        self.room = start
+        self.this_exit = None
+        self.printed = []
+
+    async def went_to_room(self, room, exit=None, info=None):
+        self.room = room
+
+    def room_by_gmcp(self, id):
+        return self.rooms.get(id)
+
+    async def print(self, msg, **kw):
+        self.printed.append(msg.format(**kw))
+
+
+def walk(path, rooms, reached, lost=False):
+    """
+    Walk @path, pipelined; the MUD reports the GMCP IDs of @reached.
+    Returns the server and the process.
+    """
+    s = FakeServer(rooms, path[0])
+    p = WalkProcess(s, path)
+    steps = [(attrdict(dir="x"), r) for r in path[1:]]
+    p._walk_from = 0
+    p.pos = len(steps)
+    w = attrdict(steps=steps, infos=[{"id": r.id_gmcp} for r in reached], prompt_lost=lost)
+    trio.run(p.arrived, w)
+    return s,p
+
+
+def test_walk_ok():
+    rooms = [Room(i) for i in range(5)]
+    s,p = walk(rooms, rooms, rooms[1:])
+    assert s.room is rooms[4]
+    assert p.pos == 4
+    assert p.pipeline == 5
+    assert not s.printed
+
+
+def test_walk_short():
+    # stopped one room early, on the path
+    rooms = [Room(i) for i in range(5)]
+    s,p = walk(rooms, rooms, rooms[1:3] + [rooms[3], rooms[3]])
+    assert s.room is rooms[3]
+    assert p.pos == 3
+    assert p.pipeline == 1
+
+
+def test_walk_off_path():
+    # the second step went somewhere else
+    rooms = [Room(i) for i in range(5)]
+    stray = Room(99)
+    s,p = walk(rooms, rooms + [stray], [rooms[1], stray, stray, stray])
+    assert s.room is stray
+    assert p.pos == 1  # the last room we know we reached
+    assert p.current_room is rooms[1]
+    assert p.pipeline == 1
+    assert "not on the path" in s.printed[-1]
+
+
+def test_walk_prompt_lost():
+    # all steps arrived, but we had to stop waiting for a prompt
+    rooms = [Room(i) for i in range(5)]
+    s,p = walk(rooms, rooms, rooms[1:], lost=True)
+    assert s.room is rooms[4]
+    assert p.pipeline == 1
+
+
+class FakeS:
+    _S__logger = attrdict(warning=lambda *a: None)
+
+    def __init__(self, cmd):
+        self.command = cmd
+        self._prompt_evt = trio.Event()
+        self._prompt_n = 1
+
+
+def test_prompt_lost_timeout():
+    async def run(more):
+        cmd = attrdict(prompt_lost=False)
+        s = FakeS(cmd)
+        async with trio.open_nursery() as n:
+            n.start_soon(S._prompt_lost_later, s, cmd, 0.05)
+            await trio.sleep(0.01)
+            if more:
+                s._prompt_n += 1  # the next prompt arrived
+        return cmd.prompt_lost, s._prompt_evt.is_set()
+
+    assert trio.run(run, False) == (True, True)
+    assert trio.run(run, True) == (False, False)
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+
+# Path finder benchmark.
+#
+# Measures, on map databases written by util/gen-testmap.py (or a copy of
+# a real one):
+# * cache warm-up: time and memory to build the room cache
+# * routing: point-to-point searches (`RoomFinder`), both on cache entries
+#   and on database rooms
+# * discovery: multi-target searches with the label, visit and fulltext
+#   checkers which the #m* aliases use
+#
+# Start and destination rooms are chosen randomly but repeatably (--seed).
+# With --json the results are printed as JSON, so that runs before and
+# after a change can be compared.
+#
+# Run from the top of the source tree:
+#   python3 util/bench-paths.py [--pairs 50] [--orm-pairs 10] [--seed 1] [--json] map.db…
+
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from statistics import median
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import trio
+
+from mudpyc.mapper.sql import SQL
+from mudpyc.mapper.walking import PathGenerator, RoomFinder, LabelChecker, VisitChecker, FulltextChecker
+
+LABEL = "shop"
+WORD = "treasure"
+
+
+def summary(times, found=None):
+    """
+    Timing statistics, in milliseconds.
+    """
+    if not times:
+        return dict(n=0)
+    times = sorted(times)
+    res = dict(n=len(times), median_ms=median(times)*1000,
+            p90_ms=times[int(len(times)*0.9)]*1000 if len(times) > 1 else times[0]*1000,
+            max_ms=times[-1]*1000, total_ms=sum(times)*1000)
+    if found is not None:
+        res["found"] = found
+    return res
+
+
+async def search(start, checker, n):
+    """
+    Run a path search until it has @n results or runs out of rooms.
+    Returns (seconds, results).
+    """
+    gen = PathGenerator(None, start, checker, n)
+    t = time.perf_counter()
+    async with trio.open_nursery() as nn:
+        async def stalled():
+            await gen.wait_stalled()
+            nn.cancel_scope.cancel()
+        nn.start_soon(stalled)
+        await gen._build()
+        nn.cancel_scope.cancel()
+    return time.perf_counter()-t, gen.results
+
+
+async def warm_up(db, ids):
+    """
+    Fill the room cache the way the client does: load the rooms, let the
+    cache updater process them. Returns seconds.
+    """
+    db.room_cache.clear()
+    db.db.expunge_all()
+    t = time.perf_counter()
+    async with trio.open_nursery() as n:
+        n.start_soon(db.cache_updater)
+        for r in db.rooms(ids, "plain"):
+            db.update_cache(r)
+        while len(db.room_cache) < len(ids):
+            await trio.sleep(0)
+        n.cancel_scope.cancel()
+    return time.perf_counter()-t
+
+
+async def bench(fn, pairs, orm_pairs, seed):
+    res = dict(db=fn, size=os.path.getsize(fn))
+    rnd = random.Random(seed)
+    t = time.perf_counter()
+    with SQL(dict(sql=dict(url="sqlite:///"+fn))) as db:
+        ids = [i for i, in db.db.query(db.Room.id_old).filter(db.Room.id_mudlet != None).order_by(db.Room.id_old)]
+        res["rooms"] = len(ids)
+        res["exits"] = db.q(db.Exit).count()
+        res["open_ms"] = (time.perf_counter()-t)*1000
+        if not ids:
+            return res
+
+        # warm-up: time, then memory (tracing slows things down)
+        res["warmup_ms"] = await warm_up(db, ids)*1000
+        gc.collect()
+        tracemalloc.start()
+        await warm_up(db, ids)
+        gc.collect()
+        mem,_ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        res["memory"] = dict(total_kb=mem/1024, per_room_b=mem/len(ids))
+
+        # routing
+        todo = [(rnd.choice(ids), rnd.choice(ids)) for _ in range(pairs)]
+        for mode,np in (("cache",pairs),("orm",orm_pairs)):
+            times = []
+            found = 0
+            steps = []
+            for a,b in todo[:np]:
+                db.db.expunge_all()
+                start = db.room_cache[a] if mode == "cache" else db.r_old(a)
+                dt,r = await search(start, RoomFinder(db.room_cache[b]), 1)
+                times.append(dt)
+                if r:
+                    found += 1
+                    steps.append(len(r[0][1])-1)
+            res[f"route_{mode}"] = summary(times, found)
+            if steps:
+                res[f"route_{mode}"]["median_steps"] = median(steps)
+
+        # discovery
+        starts = [rnd.choice(ids) for _ in range(max(pairs//5, 1))]
+        orm_starts = starts[:max(orm_pairs//5, 1)] if orm_pairs else []
+        last = db.db.query(db.func.max(db.Room.last_visit)).scalar() or 0
+        for name,st,mk,n in (
+                ("label", starts, lambda: LabelChecker(LABEL), 5),
+                ("visit", orm_starts, lambda: VisitChecker(last//2), 5),
+                ("fulltext", orm_starts, lambda: FulltextChecker(WORD), 3),
+                ):
+            times = []
+            found = 0
+            for a in st:
+                db.db.expunge_all()
+                start = db.room_cache[a] if name == "label" else db.r_old(a)
+                dt,r = await search(start, mk(), n)
+                times.append(dt)
+                found += len(r)
+            res[f"find_{name}"] = summary(times, found)
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark MudPyC's path finder")
+    ap.add_argument("--pairs", type=int, default=50, help="routes to search in the cache")
+    ap.add_argument("--orm-pairs", type=int, default=10, help="routes to search in the database")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="print JSON")
+    ap.add_argument("db", nargs="+", help="SQLite map databases")
+    args = ap.parse_args()
+
+    results = []
+    for fn in args.db:
+        results.append(trio.run(bench, fn, args.pairs, args.orm_pairs, args.seed))
+
+    if args.json:
+        json.dump(dict(seed=args.seed, results=results), sys.stdout, indent=2)
+        print()
+        return
+    for r in results:
+        print(f"{r['db']}: {r['rooms']} rooms, {r['exits']} exits, opened in {r['open_ms']:.1f} ms")
+        if "warmup_ms" not in r:
+            continue
+        print(f"    cache warm-up {r['warmup_ms']:.1f} ms, {r['memory']['total_kb']:.0f} kB"
+                f" ({r['memory']['per_room_b']:.0f} bytes/room)")
+        for k,v in r.items():
+            if not isinstance(v, dict) or "median_ms" not in v:
+                continue
+            print(f"    {k:14} n={v['n']:<4} median {v['median_ms']:8.2f} ms"
+                    f"  p90 {v['p90_ms']:8.2f} ms  max {v['max_ms']:8.2f} ms  found {v['found']}")
+
+if __name__ == "__main__":
+    main()
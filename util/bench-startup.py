@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+
+# Startup benchmark.
+#
+# Measures
+# * import time of the main entry points, using "python -X importtime";
+#   the slowest modules are listed so that regressions are easy to spot
+# * time to first message, i.e. from starting the interpreter until a
+#   FIFO-based Server has accepted Mudlet's "up" message.
+#
+# Run from the top of the source tree:
+#   python3 util/bench-startup.py [--runs N] [--json]
+
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from statistics import median
+
+MODULES = ["mudpyc", "mudpyc.mapper.main"]
+
+CHILD = """
+import sys,time
+t0 = float(sys.argv[1])
+import trio
+from mudpyc import Server
+t_import = time.time()
+
+async def main():
+    cfg = dict(name="bench", server=dict(fifo=sys.argv[2]))
+    async with Server("bench", cfg) as s:
+        t_up = time.time()
+        print(t_import-t0, t_up-t0)
+        s.main.cancel_scope.cancel()
+trio.run(main)
+"""
+
+
+def importtime(mod):
+    """
+    Returns (total µs, [(cumulative µs, module), …]) for importing @mod.
+    """
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {mod}"],
+            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+    if res.returncode:
+        raise RuntimeError(res.stderr.strip().split("\n")[-1])
+    mods = []
+    total = 0
+    for line in res.stderr.split("\n"):
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _,cum,name = line[12:].split("|")
+        cum = int(cum)
+        mods.append((cum, name.strip()))
+        if not name.startswith("  "):  # top level
+            total += cum
+    mods.sort(reverse=True)
+    return total, mods
+
+
+def first_message():
+    """
+    Returns (import time, time until connected) in seconds.
+    """
+    with tempfile.TemporaryDirectory() as d:
+        fifo = os.path.join(d, "bench.fifo")
+        t0 = time.time()
+        p = subprocess.Popen([sys.executable, "-c", CHILD, str(t0), d], stdout=subprocess.PIPE, text=True)
+        while not os.path.exists(fifo):
+            if p.poll() is not None:
+                raise RuntimeError("child died")
+            time.sleep(0.001)
+        msg = json.dumps(dict(action="up"))
+        with open(fifo, "w") as f:
+            f.write(f"{len(msg)}\n{msg}")
+            f.flush()
+            # keep the FIFO open, the server treats EOF as an error
+            out,_ = p.communicate(timeout=30)
+        if p.returncode:
+            raise RuntimeError("child failed")
+        return tuple(float(x) for x in out.split())
+
+
+def main():
+    runs = 5
+    as_json = "--json" in sys.argv
+    if "--runs" in sys.argv:
+        runs = int(sys.argv[sys.argv.index("--runs")+1])
+
+    res = dict(imports={}, first_message=None)
+    for mod in MODULES:
+        try:
+            t = [importtime(mod) for _ in range(runs)]
+        except RuntimeError as exc:
+            res['imports'][mod] = dict(error=str(exc))
+            continue
+        total = median(x[0] for x in t)
+        res['imports'][mod] = dict(total_ms=total/1000, top=[(c/1000,m) for c,m in t[-1][1][:10]])
+    try:
+        t = [first_message() for _ in range(runs)]
+    except (RuntimeError, subprocess.TimeoutExpired) as exc:
+        res['first_message'] = dict(error=str(exc))
+    else:
+        res['first_message'] = dict(import_ms=median(x[0] for x in t)*1000,
+                connected_ms=median(x[1] for x in t)*1000)
+
+    if as_json:
+        json.dump(res, sys.stdout, indent=2)
+        print()
+        return
+    for mod,r in res['imports'].items():
+        if 'error' in r:
+            print(f"{mod}: {r['error']}")
+            continue
+        print(f"{mod}: {r['total_ms']:.1f} ms")
+        for c,m in r['top']:
+            print(f"    {c:8.1f} {m}")
+    r = res['first_message']
+    if 'error' in r:
+        print(f"first message: {r['error']}")
+    else:
+        print(f"first message: imports {r['import_ms']:.1f} ms, connected {r['connected_ms']:.1f} ms")
+
+if __name__ == "__main__":
+    main()
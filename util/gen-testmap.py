@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+
+# Synthetic map generator.
+#
+# Writes an SQLite database with a map of the given shape and size, for
+# benchmarking the path finder (see util/bench-paths.py) without a real
+# MUD's map.
+#
+# Shapes:
+# * grid: a square grid, each room connected to its four neighbours
+# * tree: a random tree, plus some extra exits that form loops
+# * clusters: small grids (one area each) joined by a few long exits
+#
+# Some exits are one-way (--oneway). Every 500th room or so is labelled
+# "shop"; a few rooms get a long description containing "treasure" and
+# a last-visit counter, for the label, fulltext and visit checkers.
+#
+# Run from the top of the source tree:
+#   python3 util/gen-testmap.py [--shape grid] [--rooms 10000] [--oneway 0.05]
+#           [--seed 1] testmap.db
+
+import os
+import sys
+import random
+import argparse
+from math import isqrt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine
+from mudpyc.mapper.sql import _models
+
+LABEL = "shop"
+WORD = "treasure"
+GRID = (("north",0,-1,"south"), ("east",1,0,"west"))
+
+
+class MapBuilder:
+    def __init__(self, oneway, rnd):
+        self.oneway = oneway
+        self.rnd = rnd
+        self.rooms = []
+        self.exits = []
+        self.areas = []
+
+    def area(self, name):
+        self.areas.append(dict(id=len(self.areas)+1, name=name, flag=0))
+        return len(self.areas)
+
+    def room(self, x, y, area, z=0):
+        n = len(self.rooms)+1
+        self.rooms.append(dict(id_old=n, id_mudlet=n, name=f"Room {n}",
+            pos_x=x, pos_y=y, pos_z=z, area_id=area, label=None, last_visit=None,
+            label_x=0, label_y=0, flag=0))
+        return n
+
+    def link(self, a, b, d, rd, cost=1):
+        self.exits.append(dict(src_id=a, dst_id=b, dir=d, cost=cost))
+        if self.rnd.random() >= self.oneway:
+            self.exits.append(dict(src_id=b, dst_id=a, dir=rd, cost=cost))
+
+    def grid(self, n, area, x0=0, y0=0):
+        """
+        A grid of @n rooms. Returns their IDs, row by row.
+        """
+        side = isqrt(n-1)+1 if n > 1 else 1
+        ids = []
+        for i in range(n):
+            x,y = i%side, i//side
+            ids.append(self.room(x0+x, y0+y, area))
+        for i,r in enumerate(ids):
+            x,y = i%side, i//side
+            for d,dx,dy,rd in GRID:
+                if dx and x+dx < side and i+dx < n:
+                    self.link(r, ids[i+dx], d, rd)
+                if dy and i+side < n:
+                    self.link(ids[i+side], r, d, rd)
+        return ids
+
+    def tree(self, n, area, loops=0.05, fanout=20):
+        ids = [self.room(0, 0, area)]
+        for i in range(1, n):
+            p = ids[self.rnd.randrange(max(0, i-fanout), i)]
+            r = self.room(i%1000, i//1000, area)
+            self.link(p, r, f"path{i}", "back")
+            ids.append(r)
+            if self.rnd.random() < loops:
+                o = ids[self.rnd.randrange(i)]
+                self.link(r, o, f"loop{i}", f"pool{i}", cost=self.rnd.randint(1,5))
+        return ids
+
+    def clusters(self, n, size=500, bridges=3):
+        groups = []
+        for c in range(0, n, size):
+            a = self.area(f"Cluster {len(groups)+1}")
+            groups.append(self.grid(min(size, n-c), a))
+        for i,g in enumerate(groups):
+            if len(groups) < 2:
+                break
+            # a ring, so that everything is reachable, plus some shortcuts
+            nxt = groups[(i+1)%len(groups)]
+            self.link(g[-1], nxt[0], f"portal{i}", f"latrop{i}", cost=5)
+            for j in range(bridges-1):
+                o = self.rnd.choice(groups)
+                if o is not g:
+                    self.link(self.rnd.choice(g), self.rnd.choice(o),
+                            f"bridge{i}.{j}", f"egdirb{i}.{j}", cost=10)
+        return [r for g in groups for r in g]
+
+
+def build(shape, n, oneway, seed):
+    rnd = random.Random(seed)
+    mb = MapBuilder(oneway, rnd)
+    if shape == "grid":
+        ids = mb.grid(n, mb.area("Grid"))
+    elif shape == "tree":
+        ids = mb.tree(n, mb.area("Tree"))
+    elif shape == "clusters":
+        ids = mb.clusters(n)
+    else:
+        raise ValueError(shape)
+
+    descr = []
+    for i,r in enumerate(ids):
+        room = mb.rooms[r-1]
+        if i % 500 == 250:
+            room["label"] = LABEL
+        if i % 50 == 0:
+            room["last_visit"] = i+1
+        if i % 997 == 500:
+            descr.append(dict(room_id=r, descr=f"There is a {WORD} here."))
+        elif i % 20 == 0:
+            descr.append(dict(room_id=r, descr=f"{room['name']} looks like any other room."))
+    return mb, descr
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a synthetic MudPyC map database")
+    ap.add_argument("--shape", choices=("grid","tree","clusters"), default="grid")
+    ap.add_argument("--rooms", type=int, default=10000)
+    ap.add_argument("--oneway", type=float, default=0.05, help="fraction of one-way exits")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("db", help="SQLite file to write (replaced if it exists)")
+    args = ap.parse_args()
+
+    if os.path.exists(args.db):
+        os.unlink(args.db)
+    mb, descr = build(args.shape, args.rooms, args.oneway, args.seed)
+
+    m = _models(True)
+    engine = create_engine("sqlite:///"+args.db)
+    m.Room.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(m.Area.__table__.insert(), mb.areas)
+        for i in range(0, len(mb.rooms), 10000):
+            conn.execute(m.Room.__table__.insert(), mb.rooms[i:i+10000])
+        for i in range(0, len(mb.exits), 10000):
+            conn.execute(m.Exit.__table__.insert(), mb.exits[i:i+10000])
+        if descr:
+            conn.execute(m.LongDescr.__table__.insert(), descr)
+        conn.execute(m.Config.__table__.insert(), [dict(name="generation", _value=b"1")])
+    print(f"{args.db}: {len(mb.rooms)} rooms, {len(mb.exits)} exits, {len(mb.areas)} areas")
+
+if __name__ == "__main__":
+    main()